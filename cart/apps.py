@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class CartConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cart'
+
+    def ready(self):
+        from django.conf import settings
+        from ecommerce_api.scheduler import scheduler
+        from .purge import purge_abandoned_carts
+
+        # purging abandoned carts from web workers, when no external cron runs `purge_carts`
+        if settings.CART_PURGE_INTERVAL:
+            scheduler.every(settings.CART_PURGE_INTERVAL, 'purge_abandoned_carts', purge_abandoned_carts)
@@ -0,0 +1,67 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from products.models import Product
+from users.models import CustomUser
+from cart.models import Cart, CartItem
+from cart.services import DatabaseCartStore
+
+
+# adding to the cart the way add_to_cart used to: read the row, add in python, save it back
+def read_modify_write(user, product_id, quantity):
+    cart, created = Cart.objects.get_or_create(user=user)
+    item, created = CartItem.objects.get_or_create(cart=cart, product_id=product_id)
+    item.quantity = quantity if created else item.quantity + quantity
+    item.save()
+
+
+class Command(BaseCommand):
+    help = 'Hammers one cart item from many threads, reporting lost updates and adds per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--adds', type=int, default=200, help='Adds per thread')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, created = CustomUser.objects.get_or_create(username='bench_cart_owner', defaults={'email': 'bench_cart_owner@example.com'})
+            product = Product.objects.create(seller=user, name='Benchmark product', description='-', price=1, stock=1)
+
+        try:
+            store = DatabaseCartStore()
+            for label, add in (('read-modify-write', read_modify_write), ('atomic upsert', store.add)):
+                CartItem.objects.filter(cart__user=user).delete()
+                elapsed, errors = self.hammer(add, user, product.pk, options['threads'], options['adds'])
+
+                expected = options['threads'] * options['adds']
+                quantity = CartItem.objects.filter(cart__user=user, product=product).values_list('quantity', flat=True).first() or 0
+                self.stdout.write(
+                    f'{label:<20} {expected / elapsed:>10,.0f} adds/s   '
+                    f'quantity {quantity}/{expected}   lost {expected - quantity - errors}   errors {errors}'
+                )
+        finally:
+            Cart.objects.filter(user=user).delete()
+            product.delete()
+            user.delete()
+
+    def hammer(self, add, user, product_id, threads_count, adds):
+        errors = []
+
+        def worker():
+            try:
+                for _ in range(adds):
+                    try:
+                        add(user, product_id, 1)
+                    except Exception:
+                        errors.append(1)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(threads_count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, len(errors)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from cart.models import Cart
+from cart.summary import check_cart_summaries
+
+
+class Command(BaseCommand):
+    help = 'Compares summaries stored on carts with their items, --repair recomputes the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        # walking carts in id ranges, every range is checked and repaired in its own short transaction
+        last_id = Cart.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+        drifted = 0
+        for first_id in range(1, last_id + 1, options['chunk_size']):
+            with transaction.atomic():
+                cart_ids = check_cart_summaries(first_id, first_id + options['chunk_size'] - 1, repair=options['repair'])
+            drifted += len(cart_ids)
+            for cart_id in cart_ids:
+                self.stdout.write(f'Cart {cart_id} summary does not match its items.')
+
+        action = 'repaired' if options['repair'] else 'found'
+        self.stdout.write(self.style.SUCCESS(f'{drifted} inconsistent cart summaries {action}.'))
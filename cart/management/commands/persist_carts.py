@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from cart.services import RedisCartStore
+
+
+class Command(BaseCommand):
+    help = 'Writes carts changed in redis to the database, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep running and persist every N seconds')
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        store = RedisCartStore()
+        while True:
+            # draining the queue of changed carts batch by batch
+            persisted = 0
+            while True:
+                count = store.persist(batch_size=options['batch_size'])
+                persisted += count
+                if count < options['batch_size']:
+                    break
+            if persisted:
+                self.stdout.write(f'{persisted} carts persisted.')
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Carts persisted.'))
@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from cart.purge import purge_abandoned_carts
+
+
+class Command(BaseCommand):
+    help = 'Deletes carts without activity for more than --days days, in chunks of cart ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.CART_PURGE_AFTER_DAYS)
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to wait between chunks')
+
+    def handle(self, *args, **options):
+        def progress(first_id, last_id, max_id, carts_deleted, items_deleted):
+            self.stdout.write(
+                f'Carts {first_id}-{last_id} of {max_id} checked: '
+                f'{carts_deleted} carts and {items_deleted} items deleted so far.'
+            )
+
+        carts_deleted, items_deleted = purge_abandoned_carts(
+            days=options['days'], chunk_size=options['chunk_size'], pause=options['pause'], progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'{carts_deleted} abandoned carts and {items_deleted} items deleted.'))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:13
+
+from django.db import migrations, models
+
+
+POPULATE_SUMMARY_SQL = """
+UPDATE cart_cart
+SET item_count = summary.item_count, line_count = summary.line_count, total = summary.total
+FROM (
+    SELECT item.cart_id, SUM(item.quantity) AS item_count, COUNT(*) AS line_count, SUM(item.quantity * product.price) AS total
+    FROM cart_cartitem AS item
+    JOIN products_product AS product ON product.id = item.product_id
+    GROUP BY item.cart_id
+) AS summary
+WHERE cart_cart.id = summary.cart_id
+"""
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='line_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14),
+        ),
+        migrations.RunSQL(
+            sql=POPULATE_SUMMARY_SQL,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
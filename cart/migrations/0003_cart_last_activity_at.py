@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:15
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0002_cart_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
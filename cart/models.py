@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from users.models import CustomUser
 from products.models import Product
 
@@ -6,6 +7,12 @@ from products.models import Product
 class Cart(models.Model):
     user = models.OneToOneField(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    # last change of the cart's items, abandoned carts are purged by it (see cart/purge.py)
+    last_activity_at = models.DateTimeField(default=timezone.now)
+    # summary of the cart's items, kept up to date by every change to them (see cart/summary.py)
+    item_count = models.PositiveIntegerField(default=0)
+    line_count = models.PositiveIntegerField(default=0)
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
 
 
 class CartItem(models.Model):
@@ -0,0 +1,44 @@
+import datetime
+import time
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Max, Min
+from django.utils import timezone
+from .models import Cart
+
+
+# carts of one id range that are inactive, locked so a concurrent change cannot slip in;
+# carts locked by an ongoing change are skipped and left for the next run
+LOCK_ABANDONED_SQL = """
+    SELECT id FROM cart_cart
+    WHERE id BETWEEN %s AND %s AND last_activity_at < %s
+    FOR UPDATE SKIP LOCKED
+"""
+
+
+def purge_abandoned_carts(days=None, chunk_size=1000, pause=0, progress=None):
+    # deleting carts inactive for more than `days` with their items, one short transaction per id range
+    days = settings.CART_PURGE_AFTER_DAYS if days is None else days
+    cutoff = timezone.now() - datetime.timedelta(days=days)
+    bounds = Cart.objects.aggregate(first_id=Min('id'), last_id=Max('id'))
+    if bounds['first_id'] is None:
+        return 0, 0
+
+    carts_deleted = items_deleted = 0
+    for first_id in range(bounds['first_id'], bounds['last_id'] + 1, chunk_size):
+        last_id = min(first_id + chunk_size - 1, bounds['last_id'])
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(LOCK_ABANDONED_SQL, [first_id, last_id, cutoff])
+            cart_ids = [row[0] for row in cursor.fetchall()]
+            if cart_ids:
+                cursor.execute('DELETE FROM cart_cartitem WHERE cart_id = ANY(%s)', [cart_ids])
+                items_deleted += cursor.rowcount
+                cursor.execute('DELETE FROM cart_cart WHERE id = ANY(%s)', [cart_ids])
+                carts_deleted += cursor.rowcount
+
+        if progress:
+            progress(first_id, last_id, bounds['last_id'], carts_deleted, items_deleted)
+        # giving replicas and autovacuum room between chunks
+        if pause:
+            time.sleep(pause)
+    return carts_deleted, items_deleted
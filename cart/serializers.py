@@ -1,10 +1,10 @@
 from rest_framework import serializers
 from .models import CartItem
-from products.serializers import ProductSerializer
+from products.serializers import ProductReadField
 
 
 class ItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = ProductReadField()
     subtotal = serializers.SerializerMethodField()
 
     class Meta():
@@ -12,4 +12,21 @@ class ItemSerializer(serializers.ModelSerializer):
         exclude = ['cart', 'id']
     
     def get_subtotal(self, obj):
-        return obj.quantity * obj.product.price
\ No newline at end of file
+        # subtotal annotated by the cart query, computed here for items loaded without it
+        subtotal = getattr(obj, 'subtotal', None)
+        if subtotal is None:
+            subtotal = obj.quantity * obj.product.price
+        return subtotal
+
+
+class CartOperationSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1, max_value=2147483647, required=False)
+    mode = serializers.ChoiceField(choices=['add', 'set', 'remove'], default='add')
+
+    def validate(self, attrs):
+        if attrs['mode'] == 'set' and 'quantity' not in attrs:
+            raise serializers.ValidationError("'quantity' is required to set an item's quantity.")
+        if attrs['mode'] == 'add':
+            attrs.setdefault('quantity', 1)
+        return attrs
@@ -0,0 +1,278 @@
+from decimal import Decimal
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import F
+from django_redis import get_redis_connection
+from products.models import Product
+from users.models import CustomUser
+from .models import Cart, CartItem
+from .summary import add_item, refresh_cart_summaries
+
+
+MAX_OPERATIONS = 500
+EMPTY_SUMMARY = {'item_count': 0, 'line_count': 0, 'total': Decimal('0.00')}
+
+
+def fold_operations(operations, quantities):
+    # final quantity of every product the batch touches, None for removed ones;
+    # operations on the same product are applied in order
+    final = {}
+    for operation in operations:
+        product_id = operation['product_id']
+        if operation['mode'] == 'remove':
+            final[product_id] = None
+        elif operation['mode'] == 'set':
+            final[product_id] = operation['quantity']
+        else:
+            final[product_id] = (final.get(product_id, quantities.get(product_id)) or 0) + operation['quantity']
+    return final
+
+
+# every cart read and write goes through a cart store, chosen by the CART_STORE setting:
+# 'database' keeps carts in Cart/CartItem rows, 'redis' keeps the live cart in a redis hash
+# per user and writes it behind to the same tables (see `persist_carts` command)
+class DatabaseCartStore:
+    def get_contents(self, user, lock=False):
+        # items with their products and subtotals in one query, the total is the sum of the fetched subtotals;
+        # `lock` holds the cart row until the end of the transaction, e.g. while checking out
+        if lock:
+            list(Cart.objects.select_for_update().filter(user=user).values_list('pk'))
+        items = list(CartItem.objects.filter(cart__user=user).select_related('product').annotate(
+            subtotal=F('quantity') * F('product__price')
+        ).order_by('pk'))
+        return items, sum(item.subtotal for item in items)
+
+    def get_summary(self, user):
+        # summary fields of the cart row, no items are read
+        summary = Cart.objects.filter(user=user).values('item_count', 'line_count', 'total').first()
+        return summary or EMPTY_SUMMARY
+
+    def add(self, user, product_id, quantity):
+        # the increment happens inside the database, concurrent adds of one product cannot lose updates,
+        # and the cart's summary is incremented by the same statement
+        cart, created = Cart.objects.get_or_create(user=user)
+        add_item(cart.pk, product_id, quantity)
+
+    def set(self, user, product_id, quantity):
+        with transaction.atomic():
+            cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id, quantity=quantity)],
+                update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity']
+            )
+            refresh_cart_summaries([cart.pk], touch=True)
+
+    def remove(self, user, product_id):
+        with transaction.atomic():
+            cart = Cart.objects.select_for_update().filter(user=user).first()
+            if cart is None:
+                return False
+            deleted, _ = CartItem.objects.filter(cart=cart, product_id=product_id).delete()
+            refresh_cart_summaries([cart.pk], touch=True)
+        return bool(deleted)
+
+    def apply(self, user, operations):
+        # locking the cart row, so batches of one user do not interleave
+        with transaction.atomic():
+            cart, created = Cart.objects.select_for_update().get_or_create(user=user)
+            product_ids = {operation['product_id'] for operation in operations}
+            quantities = dict(CartItem.objects.filter(cart=cart, product_id__in=product_ids).values_list('product_id', 'quantity'))
+            final = fold_operations(operations, quantities)
+
+            # one upsert on the (cart, product) unique constraint and one delete for the whole batch
+            items = [CartItem(cart=cart, product_id=product_id, quantity=quantity) for product_id, quantity in final.items() if quantity]
+            removed = [product_id for product_id, quantity in final.items() if quantity is None and product_id in quantities]
+            if items:
+                CartItem.objects.bulk_create(items, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity'])
+            if removed:
+                CartItem.objects.filter(cart=cart, product_id__in=removed).delete()
+            refresh_cart_summaries([cart.pk], touch=True)
+
+    def clear(self, user):
+        with transaction.atomic():
+            list(Cart.objects.select_for_update().filter(user=user).values_list('pk'))
+            CartItem.objects.filter(cart__user=user).delete()
+            Cart.objects.filter(user=user).update(**EMPTY_SUMMARY, last_activity_at=timezone.now())
+
+
+class RedisCartStore:
+    # hash field marking a cart that was loaded from the database, product ids are the other fields
+    LOADED_FIELD = 'loaded'
+    KEY = 'cart:{}'
+    DIRTY_KEY = 'cart:dirty'
+    # set while a clear is not committed yet, expiring in case its transaction is rolled back
+    CLEARING_KEY = 'cart:{}:clearing'
+    CLEARING_TTL = 60
+
+    def __init__(self):
+        self.connection = get_redis_connection('default')
+
+    def get_contents(self, user, lock=False):
+        # `lock` takes the cart row like the database store does, creating it for a cart that was never
+        # persisted; a cart whose clear is committed but whose hash is not emptied yet reads as empty
+        if lock:
+            Cart.objects.select_for_update().get_or_create(user=user)
+            if self.connection.exists(self.CLEARING_KEY.format(user.pk)):
+                return [], 0
+        quantities = self.get_quantities(user.pk)
+        products = Product.objects.in_bulk(list(quantities))
+
+        # products deleted since they were added are skipped
+        items = []
+        for product_id in sorted(quantities):
+            product = products.get(product_id)
+            if product is None:
+                continue
+            item = CartItem(product=product, quantity=quantities[product_id])
+            item.subtotal = item.quantity * product.price
+            items.append(item)
+        return items, sum(item.subtotal for item in items)
+
+    def get_summary(self, user):
+        # quantities come from the hash, only prices are read from the database
+        quantities = self.get_quantities(user.pk)
+        if not quantities:
+            return EMPTY_SUMMARY
+        prices = dict(Product.objects.filter(pk__in=list(quantities)).values_list('pk', 'price'))
+        return {
+            'item_count': sum(quantities[product_id] for product_id in prices),
+            'line_count': len(prices),
+            'total': sum((quantities[product_id] * price for product_id, price in prices.items()), Decimal('0.00')),
+        }
+
+    def add(self, user, product_id, quantity):
+        self.load(user.pk)
+        self.write(user.pk, lambda pipe, key: pipe.hincrby(key, product_id, quantity))
+
+    def set(self, user, product_id, quantity):
+        self.load(user.pk)
+        self.write(user.pk, lambda pipe, key: pipe.hset(key, product_id, quantity))
+
+    def remove(self, user, product_id):
+        self.load(user.pk)
+        removed = self.write(user.pk, lambda pipe, key: pipe.hdel(key, product_id))
+        return bool(removed)
+
+    def apply(self, user, operations):
+        # the whole batch is one MULTI/EXEC round trip
+        def queue(pipe, key):
+            for operation in operations:
+                if operation['mode'] == 'remove':
+                    pipe.hdel(key, operation['product_id'])
+                elif operation['mode'] == 'set':
+                    pipe.hset(key, operation['product_id'], operation['quantity'])
+                else:
+                    pipe.hincrby(key, operation['product_id'], operation['quantity'])
+
+        self.load(user.pk)
+        self.write(user.pk, queue)
+
+    def clear(self, user):
+        # rows are removed right away, a cart that is loaded again must not bring them back;
+        # the hash is emptied once the surrounding transaction commits, until then the clearing
+        # marker keeps `persist_cart` from writing the old hash back
+        with transaction.atomic():
+            list(Cart.objects.select_for_update().filter(user=user).values_list('pk'))
+            self.connection.set(self.CLEARING_KEY.format(user.pk), 1, ex=self.CLEARING_TTL)
+            CartItem.objects.filter(cart__user=user).delete()
+            Cart.objects.filter(user=user).update(**EMPTY_SUMMARY, last_activity_at=timezone.now())
+            transaction.on_commit(lambda: self.clear_hash(user.pk))
+
+    def clear_hash(self, user_id):
+        key = self.KEY.format(user_id)
+        pipe = self.connection.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, self.LOADED_FIELD, 1)
+        pipe.expire(key, settings.CART_REDIS_TTL)
+        pipe.srem(self.DIRTY_KEY, user_id)
+        pipe.delete(self.CLEARING_KEY.format(user_id))
+        pipe.execute()
+
+    def get_quantities(self, user_id):
+        self.load(user_id)
+        fields = self.connection.hgetall(self.KEY.format(user_id))
+        return {int(field): int(value) for field, value in fields.items() if field != self.LOADED_FIELD.encode()}
+
+    def load(self, user_id):
+        # read-through: a cart that is not in redis yet (or expired) starts from its persisted rows
+        key = self.KEY.format(user_id)
+        if self.connection.hexists(key, self.LOADED_FIELD):
+            return
+        rows = CartItem.objects.filter(cart__user_id=user_id).values_list('product_id', 'quantity')
+        pipe = self.connection.pipeline()
+        for product_id, quantity in rows:
+            pipe.hsetnx(key, product_id, quantity)
+        pipe.hset(key, self.LOADED_FIELD, 1)
+        pipe.expire(key, settings.CART_REDIS_TTL)
+        pipe.execute()
+
+    def write(self, user_id, operation):
+        # changing the hash and queueing the cart for persistence in one round trip
+        key = self.KEY.format(user_id)
+        pipe = self.connection.pipeline()
+        operation(pipe, key)
+        pipe.expire(key, settings.CART_REDIS_TTL)
+        pipe.sadd(self.DIRTY_KEY, user_id)
+        return pipe.execute()[0]
+
+    def persist(self, batch_size=100):
+        # writing queued carts to Cart/CartItem, a cart leaves the queue in `persist_cart`
+        user_ids = [int(user_id) for user_id in self.connection.srandmember(self.DIRTY_KEY, batch_size)]
+        persisted = 0
+        for user_id in user_ids:
+            try:
+                persisted += self.persist_cart(user_id)
+            except Exception:
+                # the database transaction was rolled back, the cart is queued again
+                self.connection.sadd(self.DIRTY_KEY, user_id)
+                raise
+        return persisted
+
+    def persist_cart(self, user_id):
+        # the cart row is locked first, the lock checkout and clear take, then the hash is read
+        # and the cart leaves the queue in one redis transaction
+        with transaction.atomic():
+            cart = Cart.objects.select_for_update().filter(user_id=user_id).first()
+            self.load(user_id)
+            quantities = self.connection.transaction(
+                lambda pipe: self.take_snapshot(pipe, user_id),
+                self.KEY.format(user_id), self.CLEARING_KEY.format(user_id), value_from_callable=True
+            )
+            if quantities is None:
+                return False
+            if cart is None:
+                if not CustomUser.objects.filter(pk=user_id).exists():
+                    # user was deleted while the cart was queued
+                    self.connection.delete(self.KEY.format(user_id))
+                    return False
+                cart = Cart.objects.create(user_id=user_id)
+            existing = set(Product.objects.filter(pk__in=list(quantities)).values_list('pk', flat=True))
+            CartItem.objects.filter(cart=cart).exclude(product_id__in=existing).delete()
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id, quantity=quantities[product_id]) for product_id in existing],
+                update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity']
+            )
+            refresh_cart_summaries([cart.pk], touch=True)
+        return True
+
+    def take_snapshot(self, pipe, user_id):
+        # runs with the hash and the clearing marker watched, a change to either one between reading
+        # and EXEC makes redis-py read again; None when there is nothing to persist
+        if not pipe.sismember(self.DIRTY_KEY, user_id) or pipe.exists(self.CLEARING_KEY.format(user_id)):
+            # persisted by another worker meanwhile, or being cleared: `clear_hash` takes it off the queue
+            return None
+        fields = pipe.hgetall(self.KEY.format(user_id))
+        pipe.multi()
+        pipe.srem(self.DIRTY_KEY, user_id)
+        return {int(field): int(value) for field, value in fields.items() if field != self.LOADED_FIELD.encode()}
+
+
+CART_STORES = {
+    'database': DatabaseCartStore,
+    'redis': RedisCartStore,
+}
+
+
+def get_cart_store():
+    return CART_STORES[settings.CART_STORE]()
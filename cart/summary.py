@@ -0,0 +1,88 @@
+from django.db import connection, transaction
+
+
+# item count, distinct lines and total of carts recomputed from their items
+SUMMARY_SQL = """
+    SELECT cart.id,
+           COALESCE(SUM(item.quantity), 0) AS item_count,
+           COUNT(item.id) AS line_count,
+           COALESCE(SUM(item.quantity * product.price), 0) AS total
+    FROM cart_cart AS cart
+    LEFT JOIN cart_cartitem AS item ON item.cart_id = cart.id
+    LEFT JOIN products_product AS product ON product.id = item.product_id
+    WHERE {where}
+    GROUP BY cart.id
+"""
+
+REFRESH_SQL = f"""
+    UPDATE cart_cart
+    SET item_count = summary.item_count, line_count = summary.line_count, total = summary.total{{activity}}
+    FROM ({SUMMARY_SQL}) AS summary
+    WHERE cart_cart.id = summary.id
+"""
+
+# adding to one item and to its cart's summary in one statement, xmax = 0 marks a newly inserted row
+ADD_ITEM_SQL = """
+    WITH item AS (
+        INSERT INTO cart_cartitem (cart_id, product_id, quantity)
+        VALUES (%(cart_id)s, %(product_id)s, %(quantity)s)
+        ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = cart_cartitem.quantity + EXCLUDED.quantity
+        RETURNING (xmax = 0) AS inserted
+    )
+    UPDATE cart_cart
+    SET item_count = item_count + %(quantity)s,
+        line_count = line_count + (SELECT inserted::int FROM item),
+        total = total + %(quantity)s * (SELECT price FROM products_product WHERE id = %(product_id)s),
+        last_activity_at = now()
+    WHERE id = %(cart_id)s
+"""
+
+
+# every cart write locks the cart row before touching its items, so writers of one cart cannot deadlock
+LOCK_CART_SQL = 'SELECT id FROM cart_cart WHERE id = %s FOR UPDATE'
+
+
+def add_item(cart_id, product_id, quantity):
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(LOCK_CART_SQL, [cart_id])
+        cursor.execute(ADD_ITEM_SQL, {'cart_id': cart_id, 'product_id': product_id, 'quantity': quantity})
+
+
+def refresh_cart_summaries(cart_ids, touch=False):
+    # called in the transaction that changed the carts' items, after their rows were locked;
+    # `touch` marks changes made by the carts' owners, price changes and repairs are not activity
+    if not cart_ids:
+        return 0
+    activity = ', last_activity_at = now()' if touch else ''
+    with connection.cursor() as cursor:
+        cursor.execute(REFRESH_SQL.format(where='cart.id = ANY(%s)', activity=activity), [list(cart_ids)])
+        return cursor.rowcount
+
+
+def carts_with_products(product_ids):
+    # carts whose total depends on the given products, e.g. before their price changes or they are deleted;
+    # their rows are locked in id order before any of their items is touched, like every cart write does
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT id FROM cart_cart
+            WHERE id IN (SELECT cart_id FROM cart_cartitem WHERE product_id = ANY(%s))
+            ORDER BY id
+            FOR UPDATE
+        """, [list(product_ids)])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def check_cart_summaries(first_id, last_id, repair=False):
+    # comparing stored summaries of a range of carts with their items, optionally fixing the ones that drifted
+    where = 'cart.id BETWEEN %s AND %s'
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            SELECT summary.id FROM ({SUMMARY_SQL.format(where=where)}) AS summary
+            JOIN cart_cart ON cart_cart.id = summary.id
+            WHERE (cart_cart.item_count, cart_cart.line_count, cart_cart.total)
+                IS DISTINCT FROM (summary.item_count, summary.line_count, summary.total)
+        """, [first_id, last_id])
+        drifted = [row[0] for row in cursor.fetchall()]
+    if repair:
+        refresh_cart_summaries(drifted)
+    return drifted
@@ -1,3 +1,481 @@
-from django.test import TestCase
+import datetime
+import os
+import threading
+import unittest
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+import redis
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from ecommerce_api.scheduler import Scheduler, scheduler
+from ecommerce_api.testing import create_user, CachedAPITestCase, LOCAL_CACHES
+from rest_framework.test import APIClient
+from products.models import Product
+from products.updates import apply_product_updates
+from orders.checkout import place_order
+from orders.models import Order
+from .models import Cart, CartItem
+from .services import DatabaseCartStore, RedisCartStore
+from .purge import purge_abandoned_carts
+from .summary import check_cart_summaries
 
-# Create your tests here.
+
+class GetCartTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cart_owner')
+        seller = create_user('cart_seller')
+        cls.products = Product.objects.bulk_create([
+            Product(seller=seller, name=f'Product {number}', description='-', price=Decimal(number) + Decimal('0.25'), stock=100)
+            for number in range(1, 21)
+        ])
+
+    def fill_cart(self, size):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=product, quantity=number + 1)
+            for number, product in enumerate(self.products[:size])
+        ])
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        # one query for items with their products and subtotals, the total is summed from them
+        for size in (1, 20):
+            with self.subTest(size=size):
+                CartItem.objects.all().delete()
+                Cart.objects.all().delete()
+                self.fill_cart(size)
+                with self.assertNumQueries(1):
+                    response = self.client.get('/cart/')
+                self.assertEqual(len(response.data['items']), size)
+
+    def test_total_and_subtotals(self):
+        self.fill_cart(3)
+        response = self.client.get('/cart/')
+
+        self.assertEqual(response.data['owner_id'], self.user.pk)
+        self.assertEqual(response.data['owner_username'], self.user.username)
+        self.assertEqual([item['subtotal'] for item in response.data['items']], [Decimal('1.25'), Decimal('4.50'), Decimal('9.75')])
+        self.assertEqual(response.data['total'], Decimal('15.50'))
+
+    def test_empty_cart(self):
+        with self.assertNumQueries(1):
+            response = self.client.get('/cart/')
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual(response.data['total'], 0)
+
+
+@override_settings(CART_STORE='database')
+class CartStoreTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('store_owner')
+        seller = create_user('store_seller')
+        cls.pen, cls.paper = Product.objects.bulk_create([
+            Product(seller=seller, name='Pen', description='-', price=Decimal('1.50'), stock=100),
+            Product(seller=seller, name='Paper', description='-', price=Decimal('4.00'), stock=100),
+        ])
+
+    def get_quantities(self):
+        return {item['product']['id']: item['quantity'] for item in self.client.get('/cart/').data['items']}
+
+    def test_add_set_and_remove(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 3}, format='json')
+        self.client.put(f'/cart/add/{self.paper.pk}', {'quantity': 4}, format='json')
+        self.assertEqual(self.get_quantities(), {self.pen.pk: 5, self.paper.pk: 4})
+
+        self.client.put(f'/cart/add/{self.pen.pk}', {'quantity': 1}, format='json')
+        response = self.client.delete(f'/cart/remove/{self.paper.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_quantities(), {self.pen.pk: 1})
+        self.assertEqual(self.client.delete(f'/cart/remove/{self.paper.pk}').status_code, 404)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.post('/cart/add/0', format='json').status_code, 404)
+        self.assertEqual(self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 0}, format='json').status_code, 400)
+        self.assertEqual(self.get_quantities(), {})
+
+    def test_batch(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        response = self.client.post('/cart/batch/', [
+            {'product_id': self.pen.pk, 'quantity': 3},
+            {'product_id': self.paper.pk, 'quantity': 5, 'mode': 'set'},
+            {'product_id': self.paper.pk, 'mode': 'add'},
+            {'product_id': 999999, 'quantity': 1},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['applied'], 3)
+        self.assertEqual(response.data['missing'], [999999])
+        self.assertEqual(self.get_quantities(), {self.pen.pk: 5, self.paper.pk: 6})
+
+        self.client.post('/cart/batch/', [
+            {'product_id': self.pen.pk, 'mode': 'remove'},
+            {'product_id': self.paper.pk, 'quantity': 1, 'mode': 'set'},
+        ], format='json')
+        self.assertEqual(self.get_quantities(), {self.paper.pk: 1})
+
+    def test_batch_query_count_does_not_depend_on_size(self):
+        seller = create_user('batch_seller')
+        products = Product.objects.bulk_create([
+            Product(seller=seller, name=f'Batch {number}', description='-', price=1, stock=10) for number in range(30)
+        ])
+        self.client.post(f'/cart/add/{self.pen.pk}', format='json')
+        counts = []
+        for batch in (products[:2], products[2:30]):
+            operations = [{'product_id': product.pk, 'quantity': 2} for product in batch]
+            operations += [{'product_id': product.pk, 'mode': 'remove'} for product in batch[:1]]
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post('/cart/batch/', operations, format='json')
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_invalid_batch(self):
+        self.assertEqual(self.client.post('/cart/batch/', [], format='json').status_code, 400)
+        response = self.client.post('/cart/batch/', [{'product_id': self.pen.pk, 'mode': 'set'}], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_summary(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        self.client.post('/cart/batch/', [{'product_id': self.paper.pk, 'quantity': 3, 'mode': 'set'}], format='json')
+        self.client.put(f'/cart/add/{self.paper.pk}', {'quantity': 1}, format='json')
+
+        summary = self.client.get('/cart/summary/').data
+        self.assertEqual((summary['item_count'], summary['line_count'], summary['total']), (3, 2, Decimal('7.00')))
+        self.assertEqual(summary['total'], self.client.get('/cart/').data['total'])
+
+        self.client.delete(f'/cart/remove/{self.pen.pk}')
+        summary = self.client.get('/cart/summary/').data
+        self.assertEqual((summary['item_count'], summary['line_count'], summary['total']), (1, 1, Decimal('4.00')))
+
+    def test_checkout_clears_cart(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        self.client.post(f'/cart/add/{self.paper.pk}', format='json')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/orders/checkout/')
+
+        self.assertEqual(response.status_code, 201)
+        order = self.user.order_set.get(pk=response.data['order_id'])
+        self.assertEqual(order.total_price, Decimal('7.00'))
+        self.assertEqual(self.get_quantities(), {})
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(self.client.get('/cart/summary/').data['item_count'], 0)
+
+
+@override_settings(CART_STORE='database')
+class CartSummaryTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('summary_owner')
+        cls.seller = create_user('summary_seller')
+        cls.pen, cls.paper = Product.objects.bulk_create([
+            Product(seller=cls.seller, name='Pen', description='-', price=Decimal('1.50'), stock=100),
+            Product(seller=cls.seller, name='Paper', description='-', price=Decimal('4.00'), stock=100),
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.client.post('/cart/batch/', [
+            {'product_id': self.pen.pk, 'quantity': 2},
+            {'product_id': self.paper.pk, 'quantity': 1},
+        ], format='json')
+
+    def get_summary(self):
+        summary = self.client.get('/cart/summary/').data
+        return summary['item_count'], summary['line_count'], summary['total']
+
+    def test_summary_is_one_query(self):
+        with self.assertNumQueries(1):
+            self.client.get('/cart/summary/')
+
+    def test_price_changes_and_deletes_reach_summary(self):
+        apply_product_updates([{'id': self.pen.pk, 'price': Decimal('2.00')}], seller=self.seller)
+        self.assertEqual(self.get_summary(), (3, 2, Decimal('8.00')))
+
+        seller_client = APIClient()
+        seller_client.force_authenticate(self.seller)
+        seller_client.put(f'/products/product/{self.paper.pk}', {'price': '5.00'}, format='json')
+        self.assertEqual(self.get_summary(), (3, 2, Decimal('9.00')))
+
+        seller_client.delete(f'/products/product/{self.paper.pk}')
+        self.assertEqual(self.get_summary(), (2, 1, Decimal('4.00')))
+
+    def test_consistency_check_repairs_drift(self):
+        Cart.objects.filter(user=self.user).update(item_count=10, total=0)
+        output = StringIO()
+        call_command('check_cart_summaries', '--repair', stdout=output)
+
+        self.assertIn('1 inconsistent cart summaries repaired', output.getvalue())
+        self.assertEqual(self.get_summary(), (3, 2, Decimal('7.00')))
+
+
+class PurgeTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('purge_seller')
+        cls.product = Product.objects.create(seller=seller, name='Pen', description='-', price=1, stock=1)
+        cls.users = [create_user(f'purge_owner_{number}') for number in range(5)]
+
+    def setUp(self):
+        super().setUp()
+        store = DatabaseCartStore()
+        for user in self.users:
+            store.add(user, self.product.pk, 1)
+        # the first three carts were last changed 40 days ago
+        old = timezone.now() - datetime.timedelta(days=40)
+        Cart.objects.filter(user__in=self.users[:3]).update(last_activity_at=old)
+
+    def test_purges_abandoned_carts_in_chunks(self):
+        chunks = []
+        carts_deleted, items_deleted = purge_abandoned_carts(days=30, chunk_size=2, progress=lambda *args: chunks.append(args))
+
+        self.assertEqual((carts_deleted, items_deleted), (3, 3))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(set(Cart.objects.values_list('user', flat=True)), {user.pk for user in self.users[3:]})
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_activity_keeps_cart(self):
+        DatabaseCartStore().add(self.users[0], self.product.pk, 1)
+        purge_abandoned_carts(days=30)
+        self.assertTrue(Cart.objects.filter(user=self.users[0]).exists())
+
+    def test_scheduled_job_runs_once_per_interval(self):
+        runs = []
+        workers = [Scheduler(), Scheduler()]
+        for worker in workers:
+            worker.every(60, 'test_job', lambda: runs.append(1))
+        # the test's own connection must stay open, it holds the test's transaction
+        with mock.patch('ecommerce_api.scheduler.connections'):
+            for worker in workers:
+                worker.run_pending()
+        self.assertEqual(len(runs), 1)
+
+    def test_scheduler_starts_with_first_request(self):
+        started = threading.Event()
+        with mock.patch.multiple(scheduler, jobs={'test_job': (60, lambda: None)}, thread=None, run=started.set):
+            self.assertIsNone(scheduler.thread)
+
+            client = APIClient()
+            client.force_authenticate(self.users[0])
+            client.get('/cart/')
+            self.assertTrue(started.wait(1))
+
+
+# redis database of the redis store tests, it is emptied before and after every test
+TEST_REDIS_URL = os.environ.get('TEST_REDIS_URL', 'redis://127.0.0.1:6379/15')
+REDIS_CACHES = {'default': {'BACKEND': 'django_redis.cache.RedisCache', 'LOCATION': TEST_REDIS_URL}}
+
+
+class RedisTestMixin:
+    # redis store tests are skipped when no redis server is running
+    @classmethod
+    def setUpClass(cls):
+        try:
+            redis.Redis.from_url(TEST_REDIS_URL, socket_connect_timeout=1).ping()
+        except redis.RedisError:
+            raise unittest.SkipTest(f'Redis is not available at {TEST_REDIS_URL}.')
+        super().setUpClass()
+
+
+# same flows on the redis store
+@override_settings(CACHES=REDIS_CACHES, CART_STORE='redis')
+class RedisCartStoreTests(RedisTestMixin, CartStoreTests):
+
+    def setUp(self):
+        super().setUp()
+        self.store = RedisCartStore()
+
+    def tearDown(self):
+        self.store.connection.flushdb()
+
+    def test_changes_are_written_behind(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+        self.store.persist()
+        self.assertEqual(dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')), {self.pen.pk: 2})
+
+        self.client.delete(f'/cart/remove/{self.pen.pk}')
+        self.client.post(f'/cart/add/{self.paper.pk}', format='json')
+        self.store.persist()
+        self.assertEqual(dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')), {self.paper.pk: 1})
+
+    def test_persist_between_clear_and_its_commit(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.store.clear(self.user)
+
+        # the rows are gone, the hash is only emptied by the commit callback
+        self.assertEqual(self.store.persist(), 0)
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.store.persist(), 0)
+        self.assertEqual(self.get_quantities(), {})
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+    def test_change_during_snapshot_is_read_again(self):
+        self.client.post(f'/cart/add/{self.pen.pk}', {'quantity': 2}, format='json')
+        take_snapshot = self.store.take_snapshot
+        changes = []
+
+        def change_first_attempt(pipe, user_id):
+            quantities = take_snapshot(pipe, user_id)
+            if not changes:
+                changes.append(self.store.write(user_id, lambda write_pipe, key: write_pipe.hset(key, self.paper.pk, 1)))
+            return quantities
+
+        with mock.patch.object(self.store, 'take_snapshot', change_first_attempt):
+            self.assertEqual(self.store.persist(), 1)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart__user=self.user).values_list('product_id', 'quantity')), {self.pen.pk: 2, self.paper.pk: 1}
+        )
+        self.assertEqual(self.store.persist(), 0)
+
+    def test_persisted_cart_is_loaded(self):
+        cart = Cart.objects.create(user=self.user)
+        CartItem.objects.create(cart=cart, product=self.pen, quantity=3)
+        self.client.post(f'/cart/add/{self.pen.pk}', format='json')
+        self.assertEqual(self.get_quantities(), {self.pen.pk: 4})
+
+
+class ConcurrentAddTests(TransactionTestCase):
+    # every thread has its own database connection, so the adds really run concurrently
+    def test_concurrent_adds_are_not_lost(self):
+        user = create_user('busy_owner')
+        product = Product.objects.create(seller=create_user('busy_seller'), name='Pen', description='-', price=1, stock=1)
+        threads_count, adds = 8, 25
+        errors = []
+
+        def add_many():
+            try:
+                store = DatabaseCartStore()
+                for _ in range(adds):
+                    store.add(user, product.pk, 1)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=add_many) for _ in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(CartItem.objects.get(cart__user=user, product=product).quantity, threads_count * adds)
+        self.assertEqual(Cart.objects.get(user=user).item_count, threads_count * adds)
+
+    def test_adds_and_sets_do_not_deadlock(self):
+        # adds and sets of the same products lock the cart row before its items
+        user = create_user('mixed_owner')
+        seller = create_user('mixed_seller')
+        products = [Product.objects.create(seller=seller, name=f'Pen {number}', description='-', price=1, stock=1) for number in range(3)]
+        cart = Cart.objects.create(user=user)
+        errors = []
+
+        def change_many(change):
+            try:
+                store = DatabaseCartStore()
+                for number in range(30):
+                    change(store, products[number % len(products)].pk)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        changes = [lambda store, pk: store.add(user, pk, 1), lambda store, pk: store.set(user, pk, 2)] * 4
+        threads = [threading.Thread(target=change_many, args=(change,)) for change in changes]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(check_cart_summaries(cart.pk, cart.pk), [])
+
+    @override_settings(CACHES=LOCAL_CACHES)
+    def test_product_deletes_and_cart_writes_do_not_deadlock(self):
+        # deleting a product locks the carts holding it in id order, before its items are removed
+        seller = create_user('deleting_seller')
+        products = [Product.objects.create(seller=seller, name=f'Pen {number}', description='-', price=1, stock=1) for number in range(8)]
+        owners = [create_user(f'deleting_owner_{number}') for number in range(4)]
+        for owner in owners:
+            DatabaseCartStore().apply(owner, [{'product_id': product.pk, 'quantity': 1, 'mode': 'add'} for product in products])
+        errors = []
+
+        def write(owner):
+            try:
+                store = DatabaseCartStore()
+                for _ in range(5):
+                    for product in reversed(products):
+                        try:
+                            store.set(owner, product.pk, 2)
+                        except IntegrityError:
+                            # the product was deleted meanwhile
+                            pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        def delete():
+            try:
+                client = APIClient()
+                client.force_authenticate(seller)
+                for product in products:
+                    self.assertEqual(client.delete(f'/products/product/{product.pk}').status_code, 204)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(owner,)) for owner in owners] + [threading.Thread(target=delete)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertFalse(CartItem.objects.exists())
+        self.assertEqual(check_cart_summaries(Cart.objects.order_by('pk').first().pk, Cart.objects.order_by('pk').last().pk), [])
+
+
+@override_settings(CACHES=REDIS_CACHES, CART_STORE='redis')
+class ConcurrentRedisCheckoutTests(RedisTestMixin, TransactionTestCase):
+    def tearDown(self):
+        RedisCartStore().connection.flushdb()
+
+    def test_cart_is_ordered_once(self):
+        # checkouts lock the cart row, the ones after the first find the cart cleared
+        user = create_user('redis_checkout_owner')
+        product = Product.objects.create(seller=create_user('redis_checkout_seller'), name='Pen', description='-', price=1, stock=10)
+        RedisCartStore().add(user, product.pk, 2)
+        start = threading.Barrier(4)
+        orders, errors = [], []
+
+        def checkout():
+            try:
+                start.wait()
+                orders.append(place_order(user))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len([order for order in orders if order is not None]), 1)
+        self.assertEqual(Order.objects.filter(user=user).count(), 1)
+        self.assertEqual(RedisCartStore().get_contents(user), ([], 0))
@@ -4,6 +4,8 @@ from . import views
 
 urlpatterns = [
     path(route='', view=views.get_cart, name='Get cart'),
+    path(route='summary/', view=views.cart_summary, name='Cart summary'),
+    path(route='batch/', view=views.update_cart, name='Change many cart items at once'),
     path(route='add/<int:item_id>', view=views.add_to_cart, name='Add product to the cart'),
-    path(route='add/<int:item_id>', view=views.remove_from_cart, name='Delete item from cart')
+    path(route='remove/<int:item_id>', view=views.remove_from_cart, name='Delete item from cart')
 ]
\ No newline at end of file
@@ -1,33 +1,32 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
-from .models import Cart, CartItem
-from .serializers import ItemSerializer
+from .serializers import ItemSerializer, CartOperationSerializer
+from .services import get_cart_store, MAX_OPERATIONS
 from products.models import Product
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from products.serializers import ProductSerializer
+from django.http import Http404
 
 
-# helper function to get/create a cart for user
-def get_user_cart(user):
-    cart, created = Cart.objects.get_or_create(user=user)
-    return cart
+# helper function to read a positive quantity from request's data
+def get_quantity(data):
+    try:
+        quantity = int(data.get('quantity', 1))
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity > 0 else None
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_cart(request):
-    # getting cart's data
-    cart = get_user_cart(request.user)
-    owner_id = cart.user.pk
-    username = request.user.username
-    items = ItemSerializer(CartItem.objects.filter(cart=cart), many=True)
-    total = sum(item['subtotal'] for item in items.data)
+    # getting cart's items with their products, subtotals and total from the cart store
+    items, total = get_cart_store().get_contents(request.user)
     data = {
-        'owner_id': owner_id,
-        'owner_username': username,
-        'items': items.data,
+        'owner_id': request.user.pk,
+        'owner_username': request.user.username,
+        'items': ItemSerializer(items, many=True).data,
         'total': total
     }
 
@@ -35,40 +34,63 @@ def get_cart(request):
     return Response(data=data, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cart_summary(request):
+    # item count, distinct lines and total for badges, without reading the items
+    summary = get_cart_store().get_summary(request.user)
+    return Response(data={'owner_id': request.user.pk, **summary}, status=status.HTTP_200_OK)
+
+
 @api_view(['POST', 'PUT'])
 @permission_classes([IsAuthenticated])
 def add_to_cart(request, item_id):
     # getting data from json request
-    cart = get_user_cart(request.user)
-    quantity = request.data.get('quantity', 1)
-    product = get_object_or_404(Product, pk=item_id)
-
-    # checking if item already exists
-    item, created = CartItem.objects.get_or_create(
-        cart=cart,
-        product=product,
-    )
-    
-    # adding item to the cart
+    quantity = get_quantity(request.data)
+    if quantity is None:
+        return Response({'msg': 'Quantity must be a positive integer'}, status=status.HTTP_400_BAD_REQUEST)
+    get_object_or_404(Product.objects.only('pk'), pk=item_id)
+
+    # adding item to the cart, or to its quantity if it is already there
+    cart_store = get_cart_store()
     if request.method == 'POST':
-        if created:
-            item.quantity = quantity
-        else:
-            item.quantity += quantity
+        cart_store.add(request.user, item_id, quantity)
+        return Response({'msg': 'Item added to cart'}, status=status.HTTP_200_OK)
     # editing quantity of existing item or adding new item to the cart
     elif request.method == 'PUT':
-        item.quantity = quantity
+        cart_store.set(request.user, item_id, quantity)
         return Response({'msg': 'Item quantity was editted'}, status=status.HTTP_200_OK)
 
-    # saving item and returning response
-    item.save()
-    return Response({'msg': 'Item added to cart'}, status=status.HTTP_200_OK)
-
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def remove_from_cart(request, item_id):
-    # finding an item in the cart and deleting it
-    item = get_object_or_404(CartItem, pk=item_id, cart=get_user_cart(request.user))
-    item.delete()
+    # finding a product in the cart and deleting it
+    if not get_cart_store().remove(request.user, item_id):
+        raise Http404('No CartItem matches the given query.')
     return Response({"message": "Item removed"}, status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_cart(request):
+    # validating list of operations
+    operations = CartOperationSerializer(data=request.data, many=True, max_length=MAX_OPERATIONS, allow_empty=False)
+    if not operations.is_valid():
+        return Response(data=operations.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # checking all added products in one query, operations on missing products are skipped
+    product_ids = {operation['product_id'] for operation in operations.validated_data if operation['mode'] != 'remove'}
+    existing = set(Product.objects.filter(pk__in=product_ids).values_list('pk', flat=True))
+    applied = [
+        operation for operation in operations.validated_data
+        if operation['mode'] == 'remove' or operation['product_id'] in existing
+    ]
+
+    # applying the whole batch to the cart at once
+    if applied:
+        get_cart_store().apply(request.user, applied)
+    return Response(
+        data={'applied': len(applied), 'missing': sorted(product_ids - existing), 'msg': 'Cart was updated'},
+        status=status.HTTP_200_OK
+    )
@@ -13,4 +13,22 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from orders.payments import close_payment_gateways, get_payment_gateway  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # lifespan events of the server build the payment gateway on startup and close its async connection
+    # pool on shutdown, everything else is served by django
+    if scope['type'] != 'lifespan':
+        return await django_application(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            get_payment_gateway()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_payment_gateways()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
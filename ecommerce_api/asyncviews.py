@@ -0,0 +1,43 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from rest_framework.decorators import api_view
+
+
+def async_api_view(http_method_names):
+    # @api_view for `async def` views: DRF's authentication, permission and throttle checks and its
+    # exception handling run in a thread, the view itself is awaited on the event loop; other decorators
+    # (@permission_classes, @throttle_classes...) are applied below it as with @api_view
+    def decorator(func):
+        view_class = api_view(http_method_names)(func).cls
+
+        class AsyncAPIView(view_class):
+            view_is_async = True
+
+            async def dispatch(self, request, *args, **kwargs):
+                self.args = args
+                self.kwargs = kwargs
+                request = self.initialize_request(request, *args, **kwargs)
+                self.request = request
+                self.headers = self.default_response_headers
+
+                try:
+                    await sync_to_async(self.initial)(request, *args, **kwargs)
+                    if request.method.lower() in self.http_method_names:
+                        handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+                    else:
+                        handler = self.http_method_not_allowed
+                    response = handler(request, *args, **kwargs)
+                    # the view's own methods return a coroutine, OPTIONS is answered by DRF right away
+                    if asyncio.iscoroutine(response):
+                        response = await response
+                except Exception as exc:
+                    response = await sync_to_async(self.handle_exception)(exc)
+
+                self.response = self.finalize_response(request, response, *args, **kwargs)
+                return self.response
+
+        AsyncAPIView.__name__ = func.__name__
+        AsyncAPIView.__module__ = func.__module__
+        return AsyncAPIView.as_view()
+
+    return decorator
@@ -0,0 +1,42 @@
+import functools
+import hashlib
+from rest_framework.serializers import BaseSerializer
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+@functools.lru_cache
+def serializer_fingerprint(serializer_class):
+    # describing the serializer's output shape, so a changed representation gets new etags
+    return hashlib.sha256(_describe(serializer_class()).encode()).hexdigest()[:16]
+
+
+def _describe(serializer):
+    parts = [type(serializer).__qualname__]
+    for name, field in serializer.fields.items():
+        field = getattr(field, 'child', field)
+        if isinstance(field, BaseSerializer):
+            parts.append(f'{name}({_describe(field)})')
+        else:
+            parts.append(f'{name}:{type(field).__name__}')
+    return ','.join(parts)
+
+
+def make_etag(*parts):
+    # strong etag from the row version and anything else the representation depends on
+    digest = hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def conditional_response(request, etag, last_modified):
+    # returning 304 response when client's copy is fresh, None when the body has to be sent
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified.timestamp()))
+    if response is not None:
+        set_conditional_headers(response, etag, last_modified)
+    return response
+
+
+def set_conditional_headers(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
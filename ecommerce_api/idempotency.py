@@ -0,0 +1,103 @@
+import asyncio
+import functools
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+def idempotent(view):
+    # requests sent with an Idempotency-Key are handled once per user, view and key: the response is
+    # kept in the cache and sent again for retries of the request, while a retry arriving during the
+    # first attempt gets 409; requests without the header are handled as usual
+    if asyncio.iscoroutinefunction(view):
+        return idempotent_async(view)
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return key_too_long()
+
+        response_key, lock_key, fingerprint = get_keys(request, view, key)
+        stored = cache.get(response_key)
+        if stored is None:
+            if not cache.add(lock_key, fingerprint, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                return still_processing()
+            try:
+                # the first attempt may have finished between reading the response and taking the lock
+                stored = cache.get(response_key)
+                if stored is None:
+                    response = view(request, *args, **kwargs)
+                    # server errors are not kept, so the request can be retried with the same key
+                    if response.status_code < 500:
+                        cache.set(response_key, to_stored(response, fingerprint), timeout=settings.IDEMPOTENCY_KEY_TTL)
+                    return response
+            finally:
+                cache.delete(lock_key)
+        return replay(stored, fingerprint)
+
+    return wrapper
+
+
+def idempotent_async(view):
+    # the same steps for async views, with the cache's async methods
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key:
+            return await view(request, *args, **kwargs)
+        if len(key) > MAX_KEY_LENGTH:
+            return key_too_long()
+
+        response_key, lock_key, fingerprint = get_keys(request, view, key)
+        stored = await cache.aget(response_key)
+        if stored is None:
+            if not await cache.aadd(lock_key, fingerprint, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                return still_processing()
+            try:
+                stored = await cache.aget(response_key)
+                if stored is None:
+                    response = await view(request, *args, **kwargs)
+                    if response.status_code < 500:
+                        await cache.aset(response_key, to_stored(response, fingerprint), timeout=settings.IDEMPOTENCY_KEY_TTL)
+                    return response
+            finally:
+                await cache.adelete(lock_key)
+        return replay(stored, fingerprint)
+
+    return wrapper
+
+
+def get_keys(request, view, key):
+    scope = hashlib.sha256(f'{request.user.pk}:{view.__name__}:{key}'.encode()).hexdigest()
+    fingerprint = hashlib.sha256(b'|'.join([request.method.encode(), request.path.encode(), request.body])).hexdigest()
+    return f'idempotency:{scope}:response', f'idempotency:{scope}:lock', fingerprint
+
+
+def to_stored(response, fingerprint):
+    return {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data}
+
+
+def replay(stored, fingerprint):
+    # a key can only be reused for the very same request
+    if stored['fingerprint'] != fingerprint:
+        return Response({'msg': f'{HEADER} was already used for a different request.'}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    response = Response(stored['data'], status=stored['status'])
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def key_too_long():
+    return Response({'msg': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters long.'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+def still_processing():
+    return Response({'msg': f'A request with this {HEADER} is still being processed.'}, status=status.HTTP_409_CONFLICT)
@@ -0,0 +1,131 @@
+import base64
+import binascii
+import datetime
+import json
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+# json encoder keeping full microsecond precision of datetimes in cursors
+class CursorEncoder(DjangoJSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime.datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+# cursor pagination keyed on a unique ordering, e.g. ('-created_at', '-id'):
+# pages are fetched with a range condition on the ordering columns instead of OFFSET,
+# so any page costs the same as the first one, and COUNT(*) only runs on `?count=true`
+class KeysetPagination:
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = tuple(ordering)
+        self.fields = [field.lstrip('-') for field in self.ordering]
+        self.descending = self.ordering[0].startswith('-')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, queryset.model)
+
+        # counting only on demand, it is the expensive part of offset pagination
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('1', 'true', 'yes'):
+            self.count = queryset.count()
+
+        # walking backwards for previous pages flips both the ordering and the comparison
+        scan_descending = self.descending != reverse
+        queryset = queryset.order_by(*[f'-{field}' if scan_descending else field for field in self.fields])
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(position, scan_descending))
+
+        # fetching one extra row to know whether there is a page after this one
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = position is not None if not reverse else has_more
+        self.first_position = self.get_position(rows[0]) if rows else None
+        self.last_position = self.get_position(rows[-1]) if rows else None
+        return rows
+
+    def position_filter(self, position, descending):
+        # (a, b) < (x, y) expanded to: a <= x AND (a < x OR (a = x AND b < y))
+        operator = 'lt' if descending else 'gt'
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.fields, position):
+            condition |= Q(**equal, **{f'{field}__{operator}': value})
+            equal[field] = value
+        return Q(**{f'{self.fields[0]}__{operator}e': position[0]}) & condition
+
+    def get_position(self, row):
+        # rows can be model instances or dictionaries from .values()
+        if isinstance(row, dict):
+            return [row[field] for field in self.fields]
+        return [getattr(row, field) for field in self.fields]
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def encode_cursor(self, position, reverse):
+        payload = json.dumps({'p': position, 'r': int(reverse)}, cls=CursorEncoder, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)))
+            values = payload['p']
+            if len(values) != len(self.fields):
+                raise ValueError
+            position = [
+                model._meta.get_field(field).to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+            return position, bool(payload.get('r'))
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_position is None:
+            return None
+        return self.encode_cursor(self.last_position, reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.first_position is None:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.first_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        response = {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
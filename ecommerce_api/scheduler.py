@@ -0,0 +1,54 @@
+import logging
+import threading
+import time
+from django.core.cache import cache
+from django.core.signals import request_started
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+# minimal in-process scheduler for periodic maintenance jobs: a daemon thread of every web worker
+# checks the registered jobs, and a cache key claimed for each run lets one worker run a job per interval
+class Scheduler:
+    tick = 30
+
+    def __init__(self):
+        self.jobs = {}
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def every(self, interval, name, function):
+        self.jobs[name] = (interval, function)
+
+    def run_pending(self):
+        for name, (interval, function) in self.jobs.items():
+            if not cache.add(f'scheduler:{name}', int(time.time()), timeout=interval):
+                continue
+            try:
+                function()
+            except Exception:
+                logger.exception('Scheduled job %s failed.', name)
+            finally:
+                # the thread's own database connections are not reused between runs
+                connections.close_all()
+
+    def start(self, **kwargs):
+        # receiver of request_started: the thread starts with the first request a wsgi or asgi server
+        # handles, so management commands never start it
+        if self.thread is not None or not self.jobs:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='scheduler', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            self.run_pending()
+            time.sleep(self.tick)
+
+
+scheduler = Scheduler()
+request_started.connect(scheduler.start, dispatch_uid='scheduler_start')
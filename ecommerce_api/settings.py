@@ -50,6 +50,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'users',
     'products',
@@ -94,6 +95,27 @@ CACHES = {
     }
 }
 
+# lifetime of cached product listings in seconds
+PRODUCT_LISTING_CACHE_TTL = env.int('PRODUCT_LISTING_CACHE_TTL', default=60)
+
+# seconds between checks of the autocomplete changelog, and largest catalog kept in memory per worker
+AUTOCOMPLETE_REFRESH_INTERVAL = env.float('AUTOCOMPLETE_REFRESH_INTERVAL', default=2.0)
+AUTOCOMPLETE_MAX_NAMES = env.int('AUTOCOMPLETE_MAX_NAMES', default=200000)
+
+# where live carts are kept: 'database' or 'redis' (written behind to the database by `persist_carts`),
+# and seconds an untouched cart stays in redis
+CART_STORE = env('CART_STORE', default='database')
+CART_REDIS_TTL = env.int('CART_REDIS_TTL', default=60 * 60 * 24 * 7)
+
+# carts without activity for this many days are purged, every CART_PURGE_INTERVAL seconds if it is set
+CART_PURGE_AFTER_DAYS = env.int('CART_PURGE_AFTER_DAYS', default=30)
+CART_PURGE_INTERVAL = env.int('CART_PURGE_INTERVAL', default=0)
+
+# seconds a response to a request with an Idempotency-Key is replayed for,
+# and longest time a first attempt may take before a retry is handled again
+IDEMPOTENCY_KEY_TTL = env.int('IDEMPOTENCY_KEY_TTL', default=60 * 60 * 24)
+IDEMPOTENCY_LOCK_TIMEOUT = env.int('IDEMPOTENCY_LOCK_TIMEOUT', default=60)
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -145,6 +167,24 @@ STRIPE_PUBLIC_KEY = env('STRIPE_PUBLIC_KEY')
 STRIPE_SECRET_KEY = env('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = env('STRIPE_WEBHOOK_SECRET')
 
+# payment provider: 'stripe', or 'fake' to answer in-process after FAKE_PAYMENT_LATENCY seconds (tests, load runs)
+PAYMENT_GATEWAY = env('PAYMENT_GATEWAY', default='stripe')
+FAKE_PAYMENT_LATENCY = env.float('FAKE_PAYMENT_LATENCY', default=0)
+
+# stripe api address, seconds to wait for a connection and for a response, retries of failed connections,
+# and connections kept open per worker process
+STRIPE_API_BASE = env('STRIPE_API_BASE', default='https://api.stripe.com')
+STRIPE_CONNECT_TIMEOUT = env.float('STRIPE_CONNECT_TIMEOUT', default=3.0)
+STRIPE_READ_TIMEOUT = env.float('STRIPE_READ_TIMEOUT', default=10.0)
+STRIPE_MAX_NETWORK_RETRIES = env.int('STRIPE_MAX_NETWORK_RETRIES', default=2)
+STRIPE_POOL_SIZE = env.int('STRIPE_POOL_SIZE', default=10)
+
+# failed webhook events are retried after 1x, 2x, 4x... STRIPE_WEBHOOK_RETRY_DELAY seconds (capped),
+# and marked as failed after STRIPE_WEBHOOK_MAX_ATTEMPTS attempts
+STRIPE_WEBHOOK_RETRY_DELAY = env.int('STRIPE_WEBHOOK_RETRY_DELAY', default=10)
+STRIPE_WEBHOOK_MAX_RETRY_DELAY = env.int('STRIPE_WEBHOOK_MAX_RETRY_DELAY', default=60 * 60)
+STRIPE_WEBHOOK_MAX_ATTEMPTS = env.int('STRIPE_WEBHOOK_MAX_ATTEMPTS', default=10)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
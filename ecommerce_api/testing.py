@@ -0,0 +1,43 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from users.models import CustomUser
+
+
+# default throttles keep their history in the cache, a local one is cleared before every test
+LOCAL_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+# helper function to create users without going through registration
+def create_user(username):
+    return CustomUser.objects.create(username=username, email=f'{username}@example.com')
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class CachedAPITestCase(TestCase):
+    # the client is authenticated as self.user, set in setUpTestData or in setUp before calling super()
+    user = None
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+        if self.user is not None:
+            self.client.force_authenticate(self.user)
+
+
+class QueryPlanTestMixin:
+    # hot queries must keep using their index: a test dataset is far smaller than production,
+    # so sequential scans are disabled and a plan has to name the index that serves the query
+    def setUp(self):
+        super().setUp()
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertUsesIndex(self, queryset, index, ordered=False):
+        # ordered: rows must come out of the index already sorted, without a Sort node on top
+        plan = queryset.explain()
+        self.assertIn(index, plan, msg=plan)
+        if ordered:
+            self.assertNotIn('Sort', plan, msg=plan)
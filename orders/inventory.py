@@ -0,0 +1,59 @@
+from collections import defaultdict
+from django.db import connection, transaction
+from products.rollups import update_rollups
+
+
+# rows are locked in id order first, so orders sharing products always wait for each other
+# in the same order and cannot deadlock
+LOCK_PRODUCTS_SQL = """
+SELECT id FROM products_product
+WHERE id = ANY(%s)
+ORDER BY id
+FOR UPDATE
+"""
+
+# decrementing every product of an order in one statement, products without enough stock are left out
+RESERVE_STOCK_SQL = """
+UPDATE products_product AS product
+SET stock = product.stock - requested.quantity, updated_at = now()
+FROM (VALUES {values}) AS requested (product_id, quantity)
+WHERE product.id = requested.product_id AND product.stock >= requested.quantity
+RETURNING product.id, product.seller_id, product.price, product.stock, product.tags, requested.quantity
+"""
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_ids):
+        self.product_ids = product_ids
+        super().__init__(f'Insufficient stock for products {product_ids}.')
+
+
+def reserve_stock(items):
+    # taking (product_id, quantity) pairs out of stock, either all of them or none
+    requested = defaultdict(int)
+    for product_id, quantity in items:
+        requested[product_id] += quantity
+    if not requested:
+        return
+    if None in requested:
+        # products deleted after the order was placed cannot be reserved
+        raise InsufficientStock([None])
+
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute(LOCK_PRODUCTS_SQL, [list(requested)])
+            cursor.execute(
+                RESERVE_STOCK_SQL.format(values=', '.join(['(%s::bigint, %s::integer)'] * len(requested))),
+                [value for item in requested.items() for value in item]
+            )
+            rows = cursor.fetchall()
+
+        # raising rolls back the decrements that did succeed
+        reserved = {row[0] for row in rows}
+        if len(reserved) != len(requested):
+            raise InsufficientStock(sorted(set(requested) - reserved))
+
+        update_rollups(
+            added=[(seller_id, price, stock, tuple(tags)) for _, seller_id, price, stock, tags, _ in rows],
+            removed=[(seller_id, price, stock + quantity, tuple(tags)) for _, seller_id, price, stock, tags, quantity in rows],
+        )
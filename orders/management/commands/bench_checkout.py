@@ -0,0 +1,61 @@
+import statistics
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from users.models import CustomUser
+from products.models import Product
+from cart.models import Cart, CartItem
+from orders.models import Order, OrderItem
+from orders.checkout import place_order
+
+
+# checkout the way it used to be: no transaction, products loaded per line and one insert per order item
+def legacy_checkout(user):
+    cart_items = CartItem.objects.filter(cart__user=user)
+    if not cart_items.exists():
+        return None
+    total_price = sum(item.quantity * item.product.price for item in cart_items)
+    order = Order.objects.create(user=user, total_price=total_price, status='pending')
+    for item in cart_items:
+        OrderItem.objects.create(order=order, product=item.product, quantity=item.quantity, price_at_purchase=item.product.price)
+    cart_items.delete()
+    return order
+
+
+class Command(BaseCommand):
+    help = 'Measures checkout latency and query count against cart size, before and after bulk checkout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 500])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, created = CustomUser.objects.get_or_create(username='bench_checkout_buyer', defaults={'email': 'bench_checkout_buyer@example.com'})
+            cart, created = Cart.objects.get_or_create(user=user)
+            products = Product.objects.bulk_create([
+                Product(seller=user, name=f'Benchmark product {number}', description='-', price=Decimal('1.99'), stock=1_000_000)
+                for number in range(max(options['sizes']))
+            ])
+
+        try:
+            self.stdout.write(f"{'lines':>6} {'legacy ms':>10} {'queries':>8} {'bulk ms':>10} {'queries':>8}")
+            for size in options['sizes']:
+                row = [f'{size:>6}']
+                for checkout in (legacy_checkout, place_order):
+                    timings = []
+                    for _ in range(options['repeat']):
+                        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=1) for product in products[:size]])
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            checkout(user)
+                            timings.append((time.perf_counter() - started) * 1000)
+                    row.append(f'{statistics.median(timings):>10.1f} {len(queries):>8}')
+                self.stdout.write(' '.join(row))
+        finally:
+            Order.objects.filter(user=user).delete()
+            CartItem.objects.filter(cart=cart).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            user.delete()
@@ -0,0 +1,148 @@
+import hashlib
+import hmac
+import json
+import threading
+import time
+from decimal import Decimal
+import stripe
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import RequestFactory
+from products.cache import invalidate_product_listings
+from products.rollups import rebuild_rollups
+from users.models import CustomUser
+from products.models import Product
+from orders.models import Order, OrderItem, WebhookEvent
+from orders.views import stripe_webhook
+from orders.webhooks import handle_payment_succeeded, process_events
+
+
+# the webhook the way it used to be: every delivery verified and applied inside the request
+def legacy_webhook(request):
+    event = stripe.Webhook.construct_event(request.body, request.META['HTTP_STRIPE_SIGNATURE'], settings.STRIPE_WEBHOOK_SECRET)
+    with transaction.atomic():
+        handle_payment_succeeded(event['data']['object'])
+    invalidate_product_listings()
+
+
+class Command(BaseCommand):
+    help = 'Sends locally signed payment events, redeliveries included, to the inline and the inbox webhook and reports throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--events', type=int, default=1000)
+        parser.add_argument('--deliveries', type=int, default=2, help='Times every event is delivered, like stripe retries')
+        parser.add_argument('--senders', type=int, default=8, help='Threads sending requests')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            user, created = CustomUser.objects.get_or_create(username='bench_webhook_buyer', defaults={'email': 'bench_webhook_buyer@example.com'})
+            products = Product.objects.bulk_create([
+                Product(seller=user, name=f'Benchmark product {number}', description='-', price=Decimal('1.99'), stock=1_000_000)
+                for number in range(20)
+            ])
+            orders = Order.objects.bulk_create([
+                Order(user=user, total_price=Decimal('5.97'), payment_intent_id=f'pi_bench_{number}')
+                for number in range(options['events'])
+            ])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=products[(number + line) % len(products)], quantity=1, price_at_purchase=Decimal('1.99'))
+                for number, order in enumerate(orders) for line in range(3)
+            ])
+
+        factory = RequestFactory()
+        requests = [self.signed_request(factory, number) for number in range(options['events'])] * options['deliveries']
+        expected_stock = 1_000_000 * len(products) - 3 * options['events']
+
+        try:
+            self.stdout.write(f"{'webhook':<8} {'requests/s':>11} {'p50 ms':>8} {'p99 ms':>8} {'events/s':>10} {'errors':>7} {'stock ok':>9}")
+
+            # inline: every request returns once its order is paid, events/s counts distinct events applied
+            elapsed, latencies, errors = self.send(legacy_webhook, requests, options['senders'])
+            self.report('inline', len(requests), options['events'], elapsed, latencies, errors, elapsed, expected_stock, products)
+            self.reset(orders, products)
+
+            # inbox: requests only store events, the workers apply them afterwards
+            elapsed, latencies, errors = self.send(stripe_webhook, requests, options['senders'])
+            started = time.perf_counter()
+            self.drain(options['workers'], options['batch_size'])
+            self.report('inbox', len(requests), options['events'], elapsed, latencies, errors, elapsed + time.perf_counter() - started, expected_stock, products)
+            drained_in = time.perf_counter() - started
+            self.stdout.write(
+                f"{WebhookEvent.objects.filter(event_id__startswith='evt_bench_', status='processed').count()} events "
+                f"processed for {len(requests)} deliveries, workers drained the inbox at {options['events'] / drained_in:,.0f} events/s."
+            )
+        finally:
+            WebhookEvent.objects.filter(event_id__startswith='evt_bench_').delete()
+            Order.objects.filter(user=user).delete()
+            Product.objects.filter(pk__in=[product.pk for product in products]).delete()
+            user.delete()
+            rebuild_rollups()
+
+    def signed_request(self, factory, number):
+        payload = json.dumps({
+            'id': f'evt_bench_{number}', 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': f'pi_bench_{number}', 'object': 'payment_intent'}},
+        })
+        timestamp = int(time.time())
+        signature = hmac.new(settings.STRIPE_WEBHOOK_SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+        return factory.post(
+            '/orders/stripe/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=f't={timestamp},v1={signature}'
+        )
+
+    def send(self, view, requests, senders):
+        latencies, errors = [], []
+        queue = list(reversed(requests))
+        lock = threading.Lock()
+
+        def sender():
+            try:
+                while True:
+                    with lock:
+                        if not queue:
+                            return
+                        request = queue.pop()
+                    started = time.perf_counter()
+                    try:
+                        view(request)
+                    except Exception:
+                        errors.append(1)
+                    latencies.append((time.perf_counter() - started) * 1000)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=sender) for _ in range(senders)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started, sorted(latencies), len(errors)
+
+    def drain(self, workers, batch_size):
+        def worker():
+            try:
+                while sum(process_events(batch_size=batch_size)) == batch_size:
+                    pass
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def report(self, label, count, events, elapsed, latencies, errors, applied_in, expected_stock, products):
+        stock = sum(Product.objects.filter(pk__in=[product.pk for product in products]).values_list('stock', flat=True))
+        self.stdout.write(
+            f'{label:<8} {count / elapsed:>11,.0f} {latencies[len(latencies) // 2]:>8.2f} '
+            f'{latencies[int(len(latencies) * 0.99)]:>8.2f} {events / applied_in:>10,.0f} {errors:>7} {str(stock == expected_stock):>9}'
+        )
+
+    def reset(self, orders, products):
+        Order.objects.filter(pk__in=[order.pk for order in orders]).update(status='pending')
+        Product.objects.filter(pk__in=[product.pk for product in products]).update(stock=1_000_000)
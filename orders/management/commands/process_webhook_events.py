@@ -0,0 +1,47 @@
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import connection
+from orders.webhooks import process_events
+
+
+class Command(BaseCommand):
+    help = 'Processes stripe events from the webhook inbox in batches, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep running and check for events every N seconds')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--workers', type=int, default=1, help='Threads processing batches side by side')
+        parser.add_argument('--lease', type=int, default=60, help='Seconds a claimed batch is hidden from other workers')
+
+    def handle(self, *args, **options):
+        lock = threading.Lock()
+        totals = {'processed': 0, 'failed': 0}
+
+        def drain():
+            # claiming batches until no event is due, workers never claim the same event
+            try:
+                while True:
+                    processed, failed = process_events(batch_size=options['batch_size'], lease=options['lease'])
+                    with lock:
+                        totals['processed'] += processed
+                        totals['failed'] += failed
+                    if processed + failed < options['batch_size']:
+                        break
+            finally:
+                connection.close()
+
+        while True:
+            threads = [threading.Thread(target=drain) for _ in range(options['workers'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            if totals['processed'] or totals['failed']:
+                self.stdout.write(f"{totals['processed']} events processed, {totals['failed']} failed.")
+                totals.update(processed=0, failed=0)
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+        self.stdout.write(self.style.SUCCESS('Webhook events processed.'))
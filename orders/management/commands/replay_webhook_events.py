@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from orders.models import WebhookEvent
+from orders.webhooks import replay_events
+
+
+class Command(BaseCommand):
+    help = 'Queues stored stripe events to be processed again, chosen by event id, status, type or time received'
+
+    def add_arguments(self, parser):
+        parser.add_argument('event_ids', nargs='*', help='Stripe event ids, e.g. evt_123')
+        parser.add_argument('--status', choices=['pending', 'processed', 'failed'])
+        parser.add_argument('--type', help='Event type, e.g. payment_intent.succeeded')
+        parser.add_argument('--since', help='Only events received after this ISO datetime')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the events')
+
+    def handle(self, *args, **options):
+        if not (options['event_ids'] or options['status'] or options['type'] or options['since']):
+            raise CommandError('Pass event ids or at least one of --status, --type and --since.')
+
+        events = WebhookEvent.objects.all()
+        if options['event_ids']:
+            events = events.filter(event_id__in=options['event_ids'])
+        if options['status']:
+            events = events.filter(status=options['status'])
+        if options['type']:
+            events = events.filter(type=options['type'])
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('--since must be an ISO datetime.')
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+            events = events.filter(received_at__gte=since)
+
+        if options['dry_run']:
+            self.stdout.write(f'{events.count()} events would be replayed.')
+            return
+        replayed = replay_events(events)
+        self.stdout.write(self.style.SUCCESS(f'{replayed} events queued for processing.'))
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:00
+
+import django.contrib.postgres.operations
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('orders', '0003_order_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+        ),
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='order',
+            index=models.Index(condition=models.Q(('payment_intent_id__isnull', False)), fields=['payment_intent_id'], name='order_payment_intent_idx'),
+        ),
+    ]
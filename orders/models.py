@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 from users.models import CustomUser
 from products.models import Product
 
@@ -7,6 +8,7 @@ class Order(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     status_choices=[('pending', 'Pending'),
                  ('paid', 'Paid'),
@@ -16,9 +18,45 @@ class Order(models.Model):
     status = models.CharField(max_length=20, choices=status_choices, default='pending')
     payment_intent_id = models.CharField(max_length=200, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='order_user_created_idx'),
+            models.Index(
+                fields=['payment_intent_id'],
+                condition=models.Q(payment_intent_id__isnull=False),
+                name='order_payment_intent_idx'
+            ),
+        ]
+
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="items")
     product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
     quantity = models.IntegerField()
     price_at_purchase = models.DecimalField(max_digits=10, decimal_places=2)
+
+
+class WebhookEvent(models.Model):
+    # inbox of verified stripe events, the unique event id turns redeliveries into no-ops
+    status_choices = [('pending', 'Pending'),
+                      ('processed', 'Processed'),
+                      ('failed', 'Failed')]
+
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=status_choices, default='pending')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['next_attempt_at', 'id'],
+                condition=models.Q(status='pending'),
+                name='webhook_event_due_idx'
+            ),
+        ]
@@ -0,0 +1,159 @@
+import asyncio
+import itertools
+import threading
+import time
+import httpx
+import requests
+import stripe
+from django.conf import settings
+
+
+# payment providers are used through a gateway chosen by the PAYMENT_GATEWAY setting: 'stripe' calls the
+# stripe api, 'fake' answers in-process for tests and load runs; every gateway method has an async twin
+# awaited under ASGI, and returns a dict with the intent's id, status and client secret
+class StripeGateway:
+    def __init__(self):
+        # one pooled session per process, connections to stripe stay open between requests
+        session = requests.Session()
+        session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=settings.STRIPE_POOL_SIZE))
+        session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=settings.STRIPE_POOL_SIZE))
+        self.client = self.build_client(stripe.RequestsClient(
+            timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT), session=session
+        ))
+        self._async_client = None
+        self._async_http_client = None
+
+    def build_client(self, http_client):
+        return stripe.StripeClient(
+            settings.STRIPE_SECRET_KEY,
+            base_addresses={'api': settings.STRIPE_API_BASE},
+            max_network_retries=settings.STRIPE_MAX_NETWORK_RETRIES,
+            http_client=http_client,
+        )
+
+    @property
+    def async_client(self):
+        # one pooled httpx client on the ASGI server's event loop, closed on lifespan shutdown
+        if self._async_client is None:
+            self._async_http_client = stripe.HTTPXClient(
+                timeout=httpx.Timeout(settings.STRIPE_READ_TIMEOUT, connect=settings.STRIPE_CONNECT_TIMEOUT)
+            )
+            self._async_client = self.build_client(self._async_http_client)
+        return self._async_client
+
+    def get_intent_params(self, amount, currency, metadata):
+        # created and confirmed in one round trip (test card, as before)
+        return {
+            'amount': amount,
+            'currency': currency,
+            'payment_method': 'pm_card_visa',
+            'confirm': True,
+            'automatic_payment_methods': {'enabled': True, 'allow_redirects': 'never'},
+            'metadata': metadata,
+        }
+
+    def create_payment_intent(self, amount, currency, metadata, idempotency_key):
+        intent = self.client.v1.payment_intents.create(
+            params=self.get_intent_params(amount, currency, metadata), options={'idempotency_key': idempotency_key}
+        )
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    async def create_payment_intent_async(self, amount, currency, metadata, idempotency_key):
+        intent = await self.async_client.v1.payment_intents.create_async(
+            params=self.get_intent_params(amount, currency, metadata), options={'idempotency_key': idempotency_key}
+        )
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    def retrieve_payment_intent(self, intent_id):
+        intent = self.client.v1.payment_intents.retrieve(intent_id)
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    async def retrieve_payment_intent_async(self, intent_id):
+        intent = await self.async_client.v1.payment_intents.retrieve_async(intent_id)
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    async def close_async(self):
+        if self._async_http_client is not None:
+            await self._async_http_client.close_async()
+            self._async_client = self._async_http_client = None
+
+
+class FakeGateway:
+    # in-process stand-in answering like stripe after FAKE_PAYMENT_LATENCY seconds, without network;
+    # a repeated idempotency key gets the first intent back, or an IdempotencyError for other parameters
+    def __init__(self):
+        self.intents = {}
+        self.counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def create_payment_intent(self, amount, currency, metadata, idempotency_key):
+        time.sleep(settings.FAKE_PAYMENT_LATENCY)
+        return self.store_intent(amount, currency, metadata, idempotency_key)
+
+    async def create_payment_intent_async(self, amount, currency, metadata, idempotency_key):
+        await asyncio.sleep(settings.FAKE_PAYMENT_LATENCY)
+        return self.store_intent(amount, currency, metadata, idempotency_key)
+
+    def store_intent(self, amount, currency, metadata, idempotency_key):
+        with self.lock:
+            if idempotency_key not in self.intents:
+                intent_id = f'pi_fake_{next(self.counter)}'
+                self.intents[idempotency_key] = {
+                    'id': intent_id, 'status': 'succeeded', 'client_secret': f'{intent_id}_secret',
+                    'amount': amount, 'currency': currency, 'metadata': metadata,
+                }
+            intent = self.intents[idempotency_key]
+        if (intent['amount'], intent['currency'], intent['metadata']) != (amount, currency, metadata):
+            raise stripe.IdempotencyError('Keys for idempotent requests can only be used with the same parameters.')
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    def retrieve_payment_intent(self, intent_id):
+        time.sleep(settings.FAKE_PAYMENT_LATENCY)
+        return self.find_intent(intent_id)
+
+    async def retrieve_payment_intent_async(self, intent_id):
+        await asyncio.sleep(settings.FAKE_PAYMENT_LATENCY)
+        return self.find_intent(intent_id)
+
+    def find_intent(self, intent_id):
+        intent = next((intent for intent in self.intents.values() if intent['id'] == intent_id), None)
+        if intent is None:
+            raise stripe.InvalidRequestError(f'No such payment_intent: {intent_id!r}', 'intent')
+        return {'id': intent['id'], 'status': intent['status'], 'client_secret': intent['client_secret']}
+
+    async def close_async(self):
+        pass
+
+
+PAYMENT_GATEWAYS = {
+    'stripe': StripeGateway,
+    'fake': FakeGateway,
+}
+
+_gateways = {}
+_gateways_lock = threading.Lock()
+
+# settings a gateway is built from, a change of any of them builds a new one
+GATEWAY_SETTINGS = (
+    'PAYMENT_GATEWAY', 'STRIPE_SECRET_KEY', 'STRIPE_API_BASE', 'STRIPE_CONNECT_TIMEOUT',
+    'STRIPE_READ_TIMEOUT', 'STRIPE_MAX_NETWORK_RETRIES', 'STRIPE_POOL_SIZE',
+)
+
+
+def get_payment_gateway():
+    # one gateway, and so one connection pool, per process and configuration;
+    # the lock keeps threads of one worker from building gateways side by side
+    key = tuple(getattr(settings, name) for name in GATEWAY_SETTINGS)
+    gateway = _gateways.get(key)
+    if gateway is None:
+        with _gateways_lock:
+            gateway = _gateways.get(key)
+            if gateway is None:
+                gateway = _gateways[key] = PAYMENT_GATEWAYS[settings.PAYMENT_GATEWAY]()
+    return gateway
+
+
+async def close_payment_gateways():
+    # releasing async connection pools when an ASGI server shuts down
+    for gateway in list(_gateways.values()):
+        await gateway.close_async()
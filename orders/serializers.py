@@ -1,10 +1,10 @@
 from rest_framework import serializers
-from products.serializers import ProductSerializer
+from products.serializers import ProductReadField, ReadPlan, PRODUCT_READ_PLAN
 from .models import OrderItem, Order
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = ProductReadField()
 
     class Meta:
         model = OrderItem
@@ -17,3 +17,39 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ['id', 'user', 'total_price', 'created_at', 'status', 'items']
+
+
+class OrderFieldsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Order
+        fields = ['id', 'user', 'total_price', 'created_at', 'status']
+
+
+class OrderItemFieldsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['quantity', 'price_at_purchase']
+
+
+# flat read path giving the same output as OrderSerializer: the order's row and its items joined with
+# their products come from .values(), and are rendered with compiled plans instead of nested serializers
+ORDER_READ_PLAN = ReadPlan(OrderFieldsSerializer)
+ORDER_ITEM_READ_PLAN = ReadPlan(OrderItemFieldsSerializer)
+ORDER_ITEM_VALUES = ('product_id', *ORDER_ITEM_READ_PLAN.fields, *[f'product__{field}' for field in PRODUCT_READ_PLAN.fields])
+
+
+def serialize_order(order_row, item_rows):
+    items = []
+    for row in item_rows:
+        item = {'product': None}
+        if row['product_id'] is not None:
+            item['product'] = PRODUCT_READ_PLAN.from_values({field: row[f'product__{field}'] for field in PRODUCT_READ_PLAN.fields})
+        item.update(ORDER_ITEM_READ_PLAN.from_values(row))
+        items.append(item)
+    return {**ORDER_READ_PLAN.from_values(order_row), 'items': items}
+
+
+class OrderHistoryFilterSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=Order.status_choices, required=False)
+    created_after = serializers.DateTimeField(required=False)
+    created_before = serializers.DateTimeField(required=False)
@@ -1,3 +1,718 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import hashlib
+import io
+import hmac
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import stripe
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Prefetch
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from ecommerce_api.testing import create_user, CachedAPITestCase, LOCAL_CACHES, QueryPlanTestMixin
+from products.models import Product
+from cart.models import Cart, CartItem
+from products.rollups import catalog_stats, rebuild_rollups
+from .models import Order, OrderItem, WebhookEvent
+from .serializers import OrderSerializer
+from .inventory import reserve_stock, InsufficientStock
+from .webhooks import get_retry_delay, process_events
+from .payments import close_payment_gateways, get_payment_gateway
+from ecommerce_api.asgi import application
 
-# Create your tests here.
+
+# helper function to sign webhook payloads the way stripe does
+def sign_payload(payload, secret):
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+
+class StripeStub:
+    # local stand-in for stripe's payment intents api, counting requests, connections and intents that were
+    # really created; like stripe, a repeated Idempotency-Key gets the first response back, or an
+    # idempotency error when the parameters differ
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.requests = 0
+        self.created = 0
+        self.connections = set()
+        self.bodies = []
+        self.responses = {}
+        self.intents = {}
+        self.retrieved = 0
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_POST(self):
+                body = parse_qs(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+                self.respond(*stub.handle(self.client_address, body, self.headers.get('Idempotency-Key')))
+
+            def do_GET(self):
+                self.respond(*stub.retrieve(self.path.rsplit('/', 1)[-1]))
+
+            def respond(self, status_code, data):
+                response = json.dumps(data).encode()
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        # clients that timed out close the connection before the answer
+        self.server.handle_error = lambda request, client_address: None
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+
+    def handle(self, client_address, body, idempotency_key):
+        time.sleep(self.delay)
+        with self.lock:
+            self.requests += 1
+            self.connections.add(client_address)
+            self.bodies.append(body)
+            if idempotency_key not in self.responses:
+                self.created += 1
+                intent_id = f'pi_stub_{self.created}'
+                self.intents[intent_id] = {
+                    'id': intent_id, 'object': 'payment_intent', 'client_secret': f'{intent_id}_secret',
+                    'status': 'succeeded' if body.get('confirm') == ['true'] else 'requires_confirmation',
+                }
+                self.responses[idempotency_key] = (body, self.intents[intent_id])
+            first_body, intent = self.responses[idempotency_key]
+            if body != first_body:
+                return 400, {'error': {'type': 'idempotency_error', 'message': 'Keys for idempotent requests can only be used with the same parameters.'}}
+            return 200, intent
+
+    def retrieve(self, intent_id):
+        with self.lock:
+            self.requests += 1
+            self.retrieved += 1
+            return 200, self.intents[intent_id]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.settings = override_settings(PAYMENT_GATEWAY='stripe', STRIPE_API_BASE=self.url, STRIPE_MAX_NETWORK_RETRIES=0)
+        self.settings.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.settings.disable()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class OrderQueryPlanTests(QueryPlanTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        users = [create_user(f'plan_buyer_{number}') for number in range(50)]
+        Order.objects.bulk_create([
+            Order(
+                user=users[number % len(users)],
+                total_price=Decimal(number % 300) + Decimal('0.50'),
+                status='paid' if number % 3 else 'pending',
+                payment_intent_id=f'pi_{number:08d}' if number % 3 else None
+            )
+            for number in range(5000)
+        ], batch_size=1000)
+        cls.user = users[0]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE orders_order')
+
+    def test_order_by_payment_intent(self):
+        self.assertUsesIndex(Order.objects.filter(payment_intent_id='pi_00000001'), 'order_payment_intent_idx')
+
+    def test_user_orders_ordered_by_creation(self):
+        self.assertUsesIndex(
+            Order.objects.filter(user=self.user).order_by('-created_at', '-id')[:10], 'order_user_created_idx', ordered=True
+        )
+
+
+@override_settings(CART_STORE='database')
+class CheckoutTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('checkout_buyer')
+        seller = create_user('checkout_seller')
+        cls.products = Product.objects.bulk_create([
+            Product(seller=seller, name=f'Product {number}', description='-', price=Decimal(number % 20) + Decimal('0.50'), stock=1000)
+            for number in range(500)
+        ])
+
+    def fill_cart(self, size):
+        cart, created = Cart.objects.get_or_create(user=self.user)
+        CartItem.objects.bulk_create([CartItem(cart=cart, product=product, quantity=2) for product in self.products[:size]])
+
+    def test_order_copies_cart(self):
+        self.fill_cart(3)
+        response = self.client.post('/orders/checkout/')
+
+        order = Order.objects.get(pk=response.data['order_id'])
+        self.assertEqual(order.total_price, Decimal('4.50') * 2)
+        self.assertEqual(
+            sorted(order.items.values_list('product_id', 'quantity', 'price_at_purchase')),
+            [(product.pk, 2, product.price) for product in self.products[:3]]
+        )
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+        self.assertEqual(self.client.post('/orders/checkout/').status_code, 400)
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        counts = []
+        for size in (1, 500):
+            self.fill_cart(size)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/orders/checkout/')
+            self.assertEqual(response.status_code, 201)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+
+@override_settings(CART_STORE='database')
+class IdempotentCheckoutTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('idempotent_buyer')
+        cls.pen = Product.objects.create(seller=create_user('idempotent_seller'), name='Pen', description='-', price=1, stock=10)
+
+    def setUp(self):
+        super().setUp()
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.pen, quantity=2)
+
+    def test_retry_returns_first_order(self):
+        first = self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(first.status_code, 201)
+
+        # the replay is answered from the cache alone
+        with self.assertNumQueries(0):
+            retry = self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual((retry.status_code, retry.data), (201, first.data))
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+
+        # a new key is a new request, and the cart is empty by now
+        self.assertEqual(self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-2').status_code, 400)
+
+    def test_key_cannot_be_reused_for_other_request(self):
+        self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        response = self.client.post('/orders/checkout/', {'note': 'other'}, format='json', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 422)
+
+    def test_keys_are_scoped_per_user(self):
+        self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        other = create_user('idempotent_other_buyer')
+        CartItem.objects.create(cart=Cart.objects.create(user=other), product=self.pen, quantity=1)
+        self.client.force_authenticate(other)
+
+        response = self.client.post('/orders/checkout/', HTTP_IDEMPOTENCY_KEY='checkout-1')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Order.objects.get(pk=response.data['order_id']).user, other)
+
+
+@override_settings(CACHES=LOCAL_CACHES, CART_STORE='database', STRIPE_SECRET_KEY='sk_test_stub')
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    # the same request sent from several threads at once, each with its own database connection
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('concurrent_idempotent_buyer')
+        self.pen = Product.objects.create(seller=create_user('concurrent_idempotent_seller'), name='Pen', description='-', price=1, stock=10)
+
+    def send_concurrently(self, path, key, count=6):
+        responses, errors = [], []
+
+        def send():
+            try:
+                client = APIClient()
+                client.force_authenticate(self.user)
+                responses.append(client.post(path, HTTP_IDEMPOTENCY_KEY=key))
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=send) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        return responses
+
+    def test_checkout_creates_one_order(self):
+        CartItem.objects.create(cart=Cart.objects.create(user=self.user), product=self.pen, quantity=2)
+        responses = self.send_concurrently('/orders/checkout/', 'checkout-1')
+
+        self.assertTrue({response.status_code for response in responses} <= {201, 409})
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        order_ids = {response.data['order_id'] for response in responses if response.status_code == 201}
+        self.assertEqual(order_ids, set(Order.objects.values_list('pk', flat=True)))
+
+    def test_payment_intent_is_created_once(self):
+        order = Order.objects.create(user=self.user, total_price=2)
+        OrderItem.objects.create(order=order, product=self.pen, quantity=2, price_at_purchase=1)
+
+        with StripeStub(delay=0.2) as stub:
+            responses = self.send_concurrently(f'/orders/{order.pk}/payment/', 'payment-1')
+            # only one attempt reached stripe, creating and confirming the intent at once
+            self.assertEqual((stub.requests, stub.created), (1, 1))
+            self.assertTrue({response.status_code for response in responses} <= {200, 409})
+            self.assertEqual({response.data['client_secret'] for response in responses if response.status_code == 200}, {'pi_stub_1_secret'})
+
+            # once the first attempt is done, retries are replayed without calling stripe
+            client = APIClient()
+            client.force_authenticate(self.user)
+            retry = client.post(f'/orders/{order.pk}/payment/', HTTP_IDEMPOTENCY_KEY='payment-1')
+            self.assertEqual((retry.status_code, retry.data['client_secret']), (200, 'pi_stub_1_secret'))
+            self.assertEqual(stub.requests, 1)
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_intent_id, 'pi_stub_1')
+
+
+@override_settings(STRIPE_SECRET_KEY='sk_test_stub')
+class PaymentGatewayTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('gateway_buyer')
+        pen = Product.objects.create(seller=create_user('gateway_seller'), name='Pen', description='-', price=Decimal('1.50'), stock=10)
+        cls.order = Order.objects.create(user=cls.user, total_price=3)
+        OrderItem.objects.create(order=cls.order, product=pen, quantity=2, price_at_purchase=Decimal('1.50'))
+
+    def test_intent_is_created_and_confirmed_in_one_call(self):
+        with StripeStub() as stub:
+            response = self.client.post(f'/orders/{self.order.pk}/payment/')
+
+        self.assertEqual((response.status_code, response.data['client_secret']), (200, 'pi_stub_1_secret'))
+        self.assertEqual(stub.requests, 1)
+        self.assertEqual((stub.bodies[0]['amount'], stub.bodies[0]['confirm']), (['300'], ['true']))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment_intent_id, 'pi_stub_1')
+
+    def test_amount_is_the_stored_total(self):
+        # prices changed after checkout do not change what the order costs
+        Product.objects.update(price=Decimal('9.99'))
+        with StripeStub() as stub:
+            self.client.post(f'/orders/{self.order.pk}/payment/')
+        self.assertEqual(stub.bodies[0]['amount'], ['300'])
+
+    def test_existing_intent_is_kept(self):
+        with StripeStub() as stub:
+            first = self.client.post(f'/orders/{self.order.pk}/payment/')
+            # stripe forgets idempotency keys after 24 hours
+            stub.responses.clear()
+            retry = self.client.post(f'/orders/{self.order.pk}/payment/')
+
+        self.assertEqual((retry.status_code, retry.data['client_secret']), (200, first.data['client_secret']))
+        self.assertEqual((stub.created, stub.retrieved), (1, 1))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).payment_intent_id, 'pi_stub_1')
+
+    def test_idempotency_error_is_a_conflict(self):
+        with StripeStub():
+            self.client.post(f'/orders/{self.order.pk}/payment/')
+            Order.objects.filter(pk=self.order.pk).update(payment_intent_id=None, total_price=5)
+            response = self.client.post(f'/orders/{self.order.pk}/payment/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_gateway_reuses_connections(self):
+        with StripeStub() as stub:
+            gateway = get_payment_gateway()
+            for number in range(3):
+                gateway.create_payment_intent(100, 'usd', {}, idempotency_key=f'pooled-{number}')
+            self.assertIs(get_payment_gateway(), gateway)
+        self.assertEqual((stub.created, len(stub.connections)), (3, 1))
+
+    def test_slow_provider_times_out(self):
+        with StripeStub(delay=0.5), self.settings(STRIPE_READ_TIMEOUT=0.1):
+            with self.assertRaises(stripe.APIConnectionError):
+                get_payment_gateway().create_payment_intent(100, 'usd', {}, idempotency_key='slow')
+
+    def test_gateway_follows_settings(self):
+        # one gateway per configuration, also when many threads ask for it at once
+        gateways = []
+        threads = [threading.Thread(target=lambda: gateways.append(get_payment_gateway())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len({id(gateway) for gateway in gateways}), 1)
+
+        with self.settings(STRIPE_READ_TIMEOUT=1):
+            self.assertIsNot(get_payment_gateway(), gateways[0])
+        self.assertIs(get_payment_gateway(), gateways[0])
+
+    @override_settings(PAYMENT_GATEWAY='fake', FAKE_PAYMENT_LATENCY=0)
+    def test_fake_gateway(self):
+        gateway = get_payment_gateway()
+        intent = gateway.create_payment_intent(100, 'usd', {}, idempotency_key='fake-1')
+        self.assertEqual(gateway.create_payment_intent(100, 'usd', {}, idempotency_key='fake-1'), intent)
+        self.assertEqual(gateway.retrieve_payment_intent(intent['id']), intent)
+        with self.assertRaises(stripe.IdempotencyError):
+            gateway.create_payment_intent(200, 'usd', {}, idempotency_key='fake-1')
+
+        response = self.client.post(f'/orders/{self.order.pk}/payment/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['client_secret'].startswith('pi_fake_'))
+
+
+
+class AsyncPaymentIntentTests(CachedAPITestCase):
+    # under ASGI the payment view awaits stripe through the gateway's async pool, on the server's event loop
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('async_gateway_buyer')
+        pen = Product.objects.create(seller=create_user('async_gateway_seller'), name='Pen', description='-', price=1, stock=10)
+        cls.orders = Order.objects.bulk_create([Order(user=cls.user, total_price=2) for _ in range(5)])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=pen, quantity=2, price_at_purchase=1) for order in cls.orders])
+
+    async def test_concurrent_intents_do_not_wait_for_each_other(self):
+        await self.async_client.aforce_login(self.user)
+        with StripeStub(delay=0.3) as stub:
+            started = time.perf_counter()
+            responses = await asyncio.gather(*[self.async_client.post(f'/orders/{order.pk}/payment/') for order in self.orders])
+            elapsed = time.perf_counter() - started
+            await close_payment_gateways()
+
+        # five calls in a row would take 1.5 seconds
+        self.assertLess(elapsed, 0.9)
+        self.assertEqual({response.status_code for response in responses}, {200})
+        self.assertEqual(stub.created, 5)
+        self.assertEqual(
+            {order.payment_intent_id async for order in Order.objects.filter(user=self.user)}, {f'pi_stub_{number}' for number in range(1, 6)}
+        )
+
+    async def test_lifespan_shutdown_closes_async_pool(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message['type'])
+
+        with StripeStub():
+            gateway = get_payment_gateway()
+            await gateway.create_payment_intent_async(100, 'usd', {}, idempotency_key='lifespan')
+            http_client = gateway._async_http_client
+            await application({'type': 'lifespan'}, receive, send)
+
+        self.assertEqual(sent, ['lifespan.startup.complete', 'lifespan.shutdown.complete'])
+        self.assertTrue(http_client._client_async.is_closed)
+        self.assertIsNone(gateway._async_http_client)
+
+class OrderHistoryTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('history_buyer')
+        seller = create_user('history_seller')
+        products = Product.objects.bulk_create([
+            Product(seller=seller, name=f'Product {number}', description='-', price=1, stock=10) for number in range(10)
+        ])
+        cls.orders = Order.objects.bulk_create([
+            Order(user=cls.user, total_price=1, status='paid' if number % 2 else 'pending') for number in range(30)
+        ] + [Order(user=seller, total_price=1)])
+        # one order a day, the last order of a page gets many items
+        start = timezone.now() - datetime.timedelta(days=30)
+        for number, order in enumerate(cls.orders):
+            order.created_at = start + datetime.timedelta(days=number)
+        Order.objects.bulk_update(cls.orders, ['created_at'])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product=product, quantity=1, price_at_purchase=1)
+            for number, order in enumerate(cls.orders)
+            for product in products[:10 if number % 5 == 0 else 1]
+        ])
+        cls.start = start
+
+    def test_pages_list_every_order_newest_first(self):
+        ids, url = [], '/orders/?page_size=7'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [order['id'] for order in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [order.pk for order in reversed(self.orders[:30])])
+
+    def test_page_query_count_does_not_depend_on_items(self):
+        # orders, their items, and the items' products
+        for page_size in (1, 20):
+            with self.assertNumQueries(3):
+                response = self.client.get(f'/orders/?page_size={page_size}')
+            self.assertEqual(len(response.data['results']), page_size)
+        self.assertEqual(len(self.client.get('/orders/?page_size=5').data['results'][4]['items']), 10)
+
+    def test_filters(self):
+        response = self.client.get('/orders/', {
+            'status': 'paid',
+            'created_after': (self.start + datetime.timedelta(days=10)).isoformat(),
+            'created_before': (self.start + datetime.timedelta(days=20)).isoformat(),
+        })
+        self.assertEqual(
+            [order['id'] for order in response.data['results']],
+            [order.pk for order in reversed(self.orders[10:20]) if order.status == 'paid']
+        )
+
+    def test_invalid_filter(self):
+        response = self.client.get('/orders/?status=lost')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('status', response.data)
+
+
+@override_settings(
+    PAYMENT_GATEWAY='fake', FAKE_PAYMENT_LATENCY=0, STRIPE_WEBHOOK_SECRET='whsec_test'
+)
+class OrderQueryBudgetTests(CachedAPITestCase):
+    # order endpoints cost the same number of queries for a one-line order and a 200-line one
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('budget_buyer')
+        seller = create_user('budget_seller')
+        products = Product.objects.bulk_create([
+            Product(seller=seller, name=f'Product {number}', description='-', price=Decimal('1.25'), stock=100, tags=['budget'])
+            for number in range(200)
+        ])
+        rebuild_rollups()
+        cls.orders = {}
+        for size in (1, 200):
+            order = Order.objects.create(user=cls.user, total_price=size * Decimal('2.50'), payment_intent_id=f'pi_budget_{size}')
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product=product, quantity=2, price_at_purchase=Decimal('1.25')) for product in products[:size]
+            ])
+            cls.orders[size] = order
+
+    def test_check_order_matches_nested_serializer(self):
+        order = self.orders[200]
+        OrderItem.objects.filter(pk=order.items.order_by('pk').values('pk')[:1]).update(product=None)
+        response = self.client.get(f'/orders/{order.pk}/')
+
+        # items are listed in the order they were added
+        order = Order.objects.prefetch_related(Prefetch('items', queryset=OrderItem.objects.order_by('pk'))).get(pk=order.pk)
+        self.assertEqual(response.json(), json.loads(JSONRenderer().render(OrderSerializer(order).data)))
+
+    def test_check_order(self):
+        for order in self.orders.values():
+            with self.assertNumQueries(2):
+                response = self.client.get(f'/orders/{order.pk}/')
+            self.assertEqual(len(response.data['items']), order.items.count())
+            with self.assertNumQueries(1):
+                response = self.client.get(f'/orders/{order.pk}/', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_create_payment_intent(self):
+        Order.objects.update(payment_intent_id=None)
+        for size, order in self.orders.items():
+            with self.assertNumQueries(3):
+                response = self.client.post(f'/orders/{order.pk}/payment/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(get_payment_gateway().intents[f'order-{order.pk}-intent']['amount'], size * 250)
+
+    def test_stripe_webhook(self):
+        counts = []
+        for size, order in self.orders.items():
+            payload = json.dumps({
+                'id': f'evt_budget_{size}', 'object': 'event', 'type': 'payment_intent.succeeded',
+                'data': {'object': {'id': order.payment_intent_id, 'object': 'payment_intent'}},
+            })
+            with self.assertNumQueries(1):
+                self.client.post(
+                    '/orders/stripe/webhook/', payload, content_type='application/json',
+                    HTTP_STRIPE_SIGNATURE=sign_payload(payload, 'whsec_test')
+                )
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(process_events(), (1, 0))
+            counts.append(len(queries))
+        # claim, then per event: order, items, stock lock and update, rollups, order and event updates, savepoints
+        self.assertEqual(counts, [12, 12])
+        self.assertEqual(set(Order.objects.filter(user=self.user).values_list('status', flat=True)), {'paid'})
+
+
+class ReserveStockTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('stock_seller')
+        cls.pen, cls.paper = Product.objects.bulk_create([
+            Product(seller=seller, name='Pen', description='-', price=1, stock=5),
+            Product(seller=seller, name='Paper', description='-', price=2, stock=1),
+        ])
+        rebuild_rollups()
+
+    def get_stock(self):
+        return dict(Product.objects.values_list('pk', 'stock'))
+
+    def test_reserves_all_items(self):
+        reserve_stock([(self.pen.pk, 2), (self.paper.pk, 1), (self.pen.pk, 3)])
+        self.assertEqual(self.get_stock(), {self.pen.pk: 0, self.paper.pk: 0})
+
+    def test_reserves_nothing_if_one_item_is_short(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock([(self.pen.pk, 2), (self.paper.pk, 2)])
+        self.assertEqual(raised.exception.product_ids, [self.paper.pk])
+        self.assertEqual(self.get_stock(), {self.pen.pk: 5, self.paper.pk: 1})
+
+    def test_rollup_follows_stock(self):
+        reserve_stock([(self.pen.pk, 2)])
+        self.assertEqual(catalog_stats()['stock_total'], 4)
+
+
+@override_settings(
+    STRIPE_WEBHOOK_SECRET='whsec_test',
+    STRIPE_WEBHOOK_RETRY_DELAY=10, STRIPE_WEBHOOK_MAX_ATTEMPTS=3
+)
+class StripeWebhookTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        buyer = create_user('webhook_buyer')
+        cls.pen = Product.objects.create(seller=create_user('webhook_seller'), name='Pen', description='-', price=1, stock=3)
+        cls.order = Order.objects.create(user=buyer, total_price=2, payment_intent_id='pi_webhook')
+        OrderItem.objects.create(order=cls.order, product=cls.pen, quantity=2, price_at_purchase=1)
+
+    def send_event(self, payment_intent_id, event_id='evt_test', secret='whsec_test'):
+        payload = json.dumps({
+            'id': event_id, 'object': 'event', 'type': 'payment_intent.succeeded',
+            'data': {'object': {'id': payment_intent_id, 'object': 'payment_intent'}},
+        })
+        return self.client.post(
+            '/orders/stripe/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=sign_payload(payload, secret)
+        )
+
+    def test_event_is_stored_once(self):
+        # the request only records the event, redeliveries are dropped by the unique event id
+        with self.assertNumQueries(1):
+            self.assertEqual(self.send_event('pi_webhook').status_code, 200)
+        self.assertEqual(self.send_event('pi_webhook').status_code, 200)
+
+        self.assertEqual(WebhookEvent.objects.get().status, 'pending')
+        self.assertEqual(Product.objects.get(pk=self.pen.pk).stock, 3)
+
+    def test_invalid_signature_is_rejected(self):
+        self.assertEqual(self.send_event('pi_webhook', secret='whsec_other').status_code, 400)
+        self.assertFalse(WebhookEvent.objects.exists())
+
+    def test_payment_reserves_stock_once(self):
+        self.send_event('pi_webhook')
+        self.send_event('pi_webhook', event_id='evt_other')
+        self.assertEqual(process_events(), (2, 0))
+
+        self.order.refresh_from_db()
+        self.pen.refresh_from_db()
+        self.assertEqual(self.order.status, 'paid')
+        self.assertEqual(self.pen.stock, 1)
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', flat=True)), {'processed'})
+
+    def test_failed_event_is_retried_with_backoff(self):
+        Product.objects.filter(pk=self.pen.pk).update(stock=1)
+        self.send_event('pi_webhook')
+        self.assertEqual(process_events(), (0, 1))
+
+        event = WebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+        self.assertIn('InsufficientStock', event.last_error)
+        self.assertGreater(event.next_attempt_at, timezone.now() + datetime.timedelta(seconds=5))
+        self.assertEqual(Order.objects.get(pk=self.order.pk).status, 'pending')
+
+        # not due yet, then retried until it runs out of attempts
+        self.assertEqual(process_events(), (0, 0))
+        for _ in range(2):
+            WebhookEvent.objects.update(next_attempt_at=timezone.now())
+            process_events()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('failed', 3))
+        self.assertEqual(get_retry_delay(3), 40)
+
+    def test_replayed_event_is_processed_again(self):
+        Product.objects.filter(pk=self.pen.pk).update(stock=1)
+        self.send_event('pi_webhook')
+        WebhookEvent.objects.update(status='failed', attempts=3)
+
+        Product.objects.filter(pk=self.pen.pk).update(stock=5)
+        call_command('replay_webhook_events', '--status', 'failed', stdout=io.StringIO())
+        self.assertEqual(process_events(), (1, 0))
+        self.assertEqual(Product.objects.get(pk=self.pen.pk).stock, 3)
+
+
+class ConcurrentReservationTests(TransactionTestCase):
+    # every thread has its own database connection, orders list the same products in opposite orders
+    def test_stock_is_never_oversold(self):
+        seller = create_user('busy_stock_seller')
+        pen, paper = Product.objects.bulk_create([
+            Product(seller=seller, name='Pen', description='-', price=1, stock=10),
+            Product(seller=seller, name='Paper', description='-', price=1, stock=10),
+        ])
+        reserved, rejected, errors = [], [], []
+
+        def buy(items):
+            try:
+                reserve_stock(items)
+                reserved.append(1)
+            except InsufficientStock:
+                rejected.append(1)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=buy, args=([(pen.pk, 1), (paper.pk, 1)] if number % 2 else [(paper.pk, 1), (pen.pk, 1)],))
+            for number in range(30)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual((len(reserved), len(rejected)), (10, 20))
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {0})
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class ConcurrentWebhookWorkerTests(TransactionTestCase):
+    # workers claiming batches side by side must never process the same event twice
+    def test_workers_share_the_inbox(self):
+        buyer = create_user('busy_webhook_buyer')
+        pen = Product.objects.create(seller=create_user('busy_webhook_seller'), name='Pen', description='-', price=1, stock=100)
+        orders = Order.objects.bulk_create([Order(user=buyer, total_price=1, payment_intent_id=f'pi_busy_{number}') for number in range(40)])
+        OrderItem.objects.bulk_create([OrderItem(order=order, product=pen, quantity=1, price_at_purchase=1) for order in orders])
+        WebhookEvent.objects.bulk_create([
+            WebhookEvent(event_id=f'evt_busy_{number}', type='payment_intent.succeeded', payload={'data': {'object': {'id': f'pi_busy_{number}'}}})
+            for number in range(40)
+        ])
+        results, errors = [], []
+
+        def work():
+            try:
+                while True:
+                    processed, failed = process_events(batch_size=5)
+                    results.append((processed, failed))
+                    if processed + failed < 5:
+                        break
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual((sum(processed for processed, _ in results), sum(failed for _, failed in results)), (40, 0))
+        self.assertEqual(set(WebhookEvent.objects.values_list('status', 'attempts')), {('processed', 1)})
+        self.assertEqual(Product.objects.get(pk=pen.pk).stock, 60)
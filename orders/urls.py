@@ -3,6 +3,7 @@ from . import views
 
 
 urlpatterns = [
+    path(route='', view=views.order_history, name='Order history'),
     path(route='checkout/', view=views.checkout, name='Checkout cart'),
     path(route='<int:id>/', view=views.check_order, name='Check an order by id'),
     path(route='<int:id>/payment/', view=views.create_payment_intent, name='Creating payment intent for an order by id'),
@@ -2,116 +2,133 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from cart.views import get_user_cart
-from cart.models import CartItem
 from .models import Order, OrderItem
-from products.models import Product
-from .serializers import OrderItemSerializer, OrderSerializer
-from django.shortcuts import get_object_or_404
+from .checkout import place_order
+from .webhooks import store_event
+from .payments import get_payment_gateway
+from .serializers import OrderSerializer, OrderHistoryFilterSerializer, ORDER_READ_PLAN, ORDER_ITEM_VALUES, serialize_order
+from django.shortcuts import aget_object_or_404
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 import stripe
+import json
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, Http404, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.db.models import Count, Max
+from ecommerce_api.conditional import serializer_fingerprint, make_etag, conditional_response, set_conditional_headers
+from ecommerce_api.asyncviews import async_api_view
+from ecommerce_api.idempotency import idempotent
+from ecommerce_api.pagination import KeysetPagination
 
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent
 def checkout(request):
-    # getting user's cart and its items
-    cart = get_user_cart(request.user)
-    cart_items = CartItem.objects.filter(cart=cart)
-
-    if not cart_items.exists():
+    # creating order from user's cart
+    order = place_order(request.user)
+    if order is None:
         return Response({'msg': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # calculating total sum of an order
-    total_price = sum(item.quantity * item.product.price for item in cart_items)
-
-    # creating order
-    order = Order.objects.create(
-        user=request.user,
-        total_price=total_price,
-        status='pending'
-    )
-
-    # creating order's items
-    for item in cart_items:
-        OrderItem.objects.create(
-            order=order,
-            product=item.product,
-            quantity=item.quantity,
-            price_at_purchase=item.product.price
-        )
-
-    # clearing cart
-    cart_items.delete()
-
     # returning response
     return Response({'msg': 'Order was created', 'order_id': order.id}, status=status.HTTP_201_CREATED)
 
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def check_order(request, id):
-    # getting user's order and displaying its information
-    order_object = get_object_or_404(Order, pk=id, user=request.user)
-    order = OrderSerializer(order_object)
-
-    return Response(data=order.data, status=status.HTTP_200_OK)
+def order_history(request):
+    # validating filters
+    filters = OrderHistoryFilterSerializer(data=request.query_params)
+    if not filters.is_valid():
+        return Response(data=filters.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    # listing user's orders, newest first, with their items and products loaded per page in two queries
+    queryset = Order.objects.filter(user=request.user).prefetch_related('items__product')
+    if 'status' in filters.validated_data:
+        queryset = queryset.filter(status=filters.validated_data['status'])
+    if 'created_after' in filters.validated_data:
+        queryset = queryset.filter(created_at__gte=filters.validated_data['created_after'])
+    if 'created_before' in filters.validated_data:
+        queryset = queryset.filter(created_at__lt=filters.validated_data['created_before'])
+
+    # paginating with cursors, so old orders cost the same as recent ones
+    paginator = KeysetPagination(ordering=('-created_at', '-id'))
+    orders = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(OrderSerializer(orders, many=True).data)
 
 
-@api_view(['POST'])
+@api_view(['GET'])
 @permission_classes([IsAuthenticated])
-def create_payment_intent(request, id):
-    # getting user's order and items
-    order_object = get_object_or_404(Order, pk=id, user=request.user)
-    items_query = OrderItem.objects.filter(order=order_object)
+def check_order(request, id):
+    # getting user's order with its version and the version of the products it contains in one query
+    order_state = Order.objects.filter(pk=id, user=request.user).annotate(
+        products_updated_at=Max('items__product__updated_at'),
+        items_count=Count('items'),
+        products_count=Count('items__product')
+    ).values(*ORDER_READ_PLAN.fields, 'updated_at', 'products_updated_at', 'items_count', 'products_count').first()
+    if order_state is None:
+        raise Http404('No Order matches the given query.')
+
+    # answering with 304 if client's copy is still up to date
+    last_modified = max(filter(None, [order_state['updated_at'], order_state['products_updated_at']]))
+    etag = make_etag(*order_state.values(), serializer_fingerprint(OrderSerializer))
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    # getting order's items joined with their products in one query and displaying order's information
+    items = OrderItem.objects.filter(order_id=order_state['id']).order_by('pk').values(*ORDER_ITEM_VALUES)
+    order = serialize_order(order_state, items)
+
+    response = Response(data=order, status=status.HTTP_200_OK)
+    return set_conditional_headers(response, etag, last_modified)
+
+
+@async_api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@idempotent
+async def create_payment_intent(request, id):
+    # getting user's order and checking that it has items
+    order_object = await aget_object_or_404(Order, pk=id, user=request.user)
 
-    if not items_query.exists():
+    if not await OrderItem.objects.filter(order=order_object).aexists():
         return Response(data={'msg': 'Order does not contain any items'}, status=status.HTTP_400_BAD_REQUEST)
     
     if order_object.status != 'pending':
         return Response(data={'msg': 'Payment intent is already created for this order.'}, status=status.HTTP_200_OK)
-    
-    # calculating total sum of an order
-    total_price = int(sum(item.quantity * item.product.price for item in items_query) * 100)
-
-    # preparing stripe and items for payment
-    stripe.api_key = settings.STRIPE_SECRET_KEY
-    line_items = []
-    for item in items_query:
-        line_items.append(
-            {
-                'price_data': {
-                    'currency': 'usd',
-                    'product_data': {'name': item.product.name},
-                    'unit_amount': int(item.product.price * 100)
+
+    # under ASGI stripe is awaited on the server's event loop through the gateway's async pool, while other
+    # requests go on; a WSGI worker runs this view on a new event loop per request, so it keeps the sync pool
+    gateway = get_payment_gateway()
+    if isinstance(request._request, ASGIRequest):
+        create_intent, retrieve_intent = gateway.create_payment_intent_async, gateway.retrieve_payment_intent_async
+    else:
+        create_intent, retrieve_intent = sync_to_async(gateway.create_payment_intent), sync_to_async(gateway.retrieve_payment_intent)
+
+    if order_object.payment_intent_id:
+        # an order keeps its first intent, also once stripe has forgotten the idempotency key after 24 hours
+        intent = await retrieve_intent(order_object.payment_intent_id)
+    else:
+        # charging the total stored at checkout, in cents, so a retry sends the very same amount
+        # even if product prices changed since; the order-scoped idempotency key makes repeated
+        # calls for the same order return the intent that was already created
+        try:
+            intent = await create_intent(
+                amount=int(order_object.total_price * 100),
+                currency='usd',
+                metadata={
+                    'order_id': order_object.id,
+                    'user_id': request.user.id,
                 },
-                'quantity': item.quantity
-            }
-        )
+                idempotency_key=f'order-{order_object.id}-intent'
+            )
+        except stripe.IdempotencyError:
+            return Response(data={'msg': 'Payment intent for this order conflicts with an earlier request, try again later.'}, status=status.HTTP_409_CONFLICT)
 
-    # creating intent for payment
-    intent = stripe.PaymentIntent.create(
-        amount=total_price,
-        currency='usd',
-        payment_method="pm_card_visa",
-        automatic_payment_methods={'enabled': True, 'allow_redirects': 'never'},
-        metadata={
-            'order_id': order_object.id,
-            'user_id': request.user.id,
-        }
-    )
-
-    # confirmin payment intent (for testing)
-    intent = stripe.PaymentIntent.confirm(
-        intent.id,
-        payment_method="pm_card_visa"
-    )
-
-    # saving payment intent id to the db
-    order_object.payment_intent_id = intent["id"]
-    order_object.save()
+        # saving payment intent id to the db
+        order_object.payment_intent_id = intent["id"]
+        await order_object.asave(update_fields=['payment_intent_id', 'updated_at'])
 
     # returning response with client's secret for payment
     return Response(data={'msg': 'Payment intent created successfully', 'client_secret': intent['client_secret']})
@@ -123,36 +140,15 @@ def stripe_webhook(request):
     payload = request.body
     sig_header = request.META.get("HTTP_STRIPE_SIGNATURE")
 
-    # creating a stripe's event
+    # verifying stripe's signature
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except Exception as error:
-        return HttpResponse(data={'msg': f'{error}'}, status=400)
+        return JsonResponse(data={'msg': f'{error}'}, status=status.HTTP_400_BAD_REQUEST)
 
-    # logic for successful payment
-    if event['type'] == 'payment_intent.succeeded':
-        intent = event['data']['object']
-        payment_intent_id = intent['id']
+    # saving the event to the inbox, orders are updated by the `process_webhook_events` worker
+    store_event(json.loads(payload))
 
-        try:
-            # getting required order
-            order_object = Order.objects.get(payment_intent_id=payment_intent_id)
-
-            # updating products' stock and checking if stock is sufficient
-            items_query = order_object.items.all()
-            for item in items_query:
-                current_product = item.product
-                if item.quantity > current_product.stock:
-                    return Response(data={'msg': f'Insufficient stock for {current_product.name}'}, status=status.HTTP_400_BAD_REQUEST)
-                current_product.stock -= item.quantity
-                current_product.save()
-            
-            # marking order as paid
-            order_object.status = 'paid'
-            order_object.save()
-        except Order.DoesNotExist:
-            return HttpResponse(status=404)
-
-    return HttpResponse(status=200)
\ No newline at end of file
+    return HttpResponse(status=200)
@@ -0,0 +1,100 @@
+import datetime
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from products.cache import invalidate_product_listings
+from .inventory import reserve_stock
+from .models import Order, WebhookEvent
+
+
+# due events are claimed by pushing their next attempt past a lease, so concurrent workers skip them;
+# an event of a worker that died is picked up again once the lease runs out
+CLAIM_EVENTS_SQL = """
+UPDATE orders_webhookevent SET next_attempt_at = %(lease_until)s
+WHERE id IN (
+    SELECT id FROM orders_webhookevent
+    WHERE status = 'pending' AND next_attempt_at <= %(now)s
+    ORDER BY next_attempt_at, id
+    LIMIT %(batch_size)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING *
+"""
+
+
+def store_event(event):
+    # saving a verified event to the inbox in one insert, redeliveries of a received event are ignored
+    WebhookEvent.objects.bulk_create(
+        [WebhookEvent(event_id=event['id'], type=event['type'], payload=event)], ignore_conflicts=True
+    )
+
+
+def handle_payment_succeeded(intent):
+    # taking all of order's items out of stock at once and marking it as paid;
+    # True when stock was changed
+    order_object = Order.objects.select_for_update().get(payment_intent_id=intent['id'])
+    if order_object.status != 'pending':
+        return False
+    reserve_stock(order_object.items.values_list('product_id', 'quantity'))
+    order_object.status = 'paid'
+    order_object.save()
+    return True
+
+
+# event types without a handler are only recorded
+HANDLERS = {
+    'payment_intent.succeeded': handle_payment_succeeded,
+}
+
+
+def get_retry_delay(attempts):
+    # exponential backoff: 1x, 2x, 4x... the base delay, capped
+    return min(settings.STRIPE_WEBHOOK_RETRY_DELAY * 2 ** (attempts - 1), settings.STRIPE_WEBHOOK_MAX_RETRY_DELAY)
+
+
+def process_event(event):
+    # the handler's changes and the event's new status are committed together, so an event is applied once;
+    # a failed event is retried later, until it runs out of attempts
+    handler = HANDLERS.get(event.type)
+    try:
+        with transaction.atomic():
+            changed = handler(event.payload['data']['object']) if handler else False
+            WebhookEvent.objects.filter(pk=event.pk).update(
+                status='processed', attempts=event.attempts + 1, last_error='', processed_at=timezone.now()
+            )
+    except Exception as error:
+        attempts = event.attempts + 1
+        WebhookEvent.objects.filter(pk=event.pk).update(
+            status='failed' if attempts >= settings.STRIPE_WEBHOOK_MAX_ATTEMPTS else 'pending',
+            attempts=attempts,
+            last_error=f'{type(error).__name__}: {error}',
+            next_attempt_at=timezone.now() + datetime.timedelta(seconds=get_retry_delay(attempts))
+        )
+        return False, False
+    return True, changed
+
+
+def process_events(batch_size=100, lease=60):
+    # claiming one batch of due events and processing them, returns (processed, failed)
+    now = timezone.now()
+    events = sorted(WebhookEvent.objects.raw(CLAIM_EVENTS_SQL, {
+        'now': now, 'lease_until': now + datetime.timedelta(seconds=lease), 'batch_size': batch_size,
+    }), key=lambda event: event.pk)
+
+    processed = failed = 0
+    stock_changed = False
+    for event in events:
+        succeeded, changed = process_event(event)
+        processed += succeeded
+        failed += not succeeded
+        stock_changed = stock_changed or changed
+
+    # cached listings are dropped once per batch instead of once per payment
+    if stock_changed:
+        invalidate_product_listings()
+    return processed, failed
+
+
+def replay_events(queryset):
+    # queueing stored events to be processed again from scratch; handlers skip work that is already done
+    return queryset.update(status='pending', attempts=0, last_error='', next_attempt_at=timezone.now(), processed_at=None)
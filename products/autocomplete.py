@@ -0,0 +1,139 @@
+import bisect
+import threading
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models.functions import Upper
+from .models import Product
+from .cache import get_counter, increment_counter
+from .params import get_limit
+
+
+# writers append the names they touched to a changelog in the shared cache,
+# every worker replays it into its own in-memory index
+SEQUENCE_KEY = 'products:autocomplete:sequence'
+CHANGE_KEY = 'products:autocomplete:change:{}'
+CHANGE_TTL = 60 * 60
+MAX_REPLAY = 1000
+
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 20
+
+
+def record_name_changes(names):
+    # called after a committed write that added, renamed or removed products
+    names = sorted({name for name in names if name})
+    if not names:
+        return
+    sequence = increment_counter(SEQUENCE_KEY)
+    cache.set(CHANGE_KEY.format(sequence), names, timeout=CHANGE_TTL)
+
+
+class NameIndex:
+    # sorted array of distinct product names keyed by their UPPER(name) from the database,
+    # a prefix lookup is one bisect plus a short scan;
+    # changelog entries only say which names changed, their presence is re-read from the database,
+    # so replaying an entry twice is harmless
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = []
+        self.names = {}
+        self.sequence = None
+        self.enabled = True
+        self.checked_at = 0.0
+
+    def search(self, prefix, limit):
+        self.refresh()
+        if not self.enabled:
+            return None
+
+        key = fold_case(prefix)
+        entries = self.entries
+        start = bisect.bisect_left(entries, (key,))
+        result = []
+        for upper_name, name in entries[start:start + limit]:
+            if not upper_name.startswith(key):
+                break
+            result.append(name)
+        return result
+
+    def refresh(self):
+        if time.monotonic() - self.checked_at < settings.AUTOCOMPLETE_REFRESH_INTERVAL:
+            return
+        with self.lock:
+            if time.monotonic() - self.checked_at < settings.AUTOCOMPLETE_REFRESH_INTERVAL:
+                return
+            self.checked_at = time.monotonic()
+
+            sequence = get_counter(SEQUENCE_KEY)
+            if self.sequence is None or sequence < self.sequence or sequence - self.sequence > MAX_REPLAY:
+                self.rebuild(sequence)
+            elif sequence > self.sequence:
+                keys = [CHANGE_KEY.format(number) for number in range(self.sequence + 1, sequence + 1)]
+                changes = cache.get_many(keys)
+                if len(changes) < len(keys):
+                    # expired or not yet written entries, the index can no longer be patched
+                    self.rebuild(sequence)
+                else:
+                    self.apply({name for key in keys for name in changes[key]})
+                    self.sequence = sequence
+
+    def rebuild(self, sequence):
+        # reading the sequence before the names, changes committed in between are replayed later
+        names = dict(
+            Product.objects.order_by('name').values_list('name', Upper('name')).distinct()[:settings.AUTOCOMPLETE_MAX_NAMES + 1]
+        )
+        self.enabled = len(names) <= settings.AUTOCOMPLETE_MAX_NAMES
+        self.names = names if self.enabled else {}
+        self.entries = sorted((key, name) for name, key in self.names.items())
+        self.sequence = sequence
+
+    def apply(self, changed):
+        if not self.enabled:
+            return
+        existing = dict(Product.objects.filter(name__in=changed).values_list('name', Upper('name')).distinct())
+
+        # the list is replaced instead of modified, so lookups without the lock see a consistent array
+        entries = list(self.entries)
+        for name in changed - existing.keys():
+            if name in self.names:
+                entries.pop(bisect.bisect_left(entries, (self.names.pop(name), name)))
+        for name, key in existing.items():
+            if name not in self.names:
+                self.names[name] = key
+                bisect.insort(entries, (key, name))
+        self.entries = entries
+
+
+# one index per worker process
+name_index = NameIndex()
+
+
+def autocomplete_names(prefix, limit=AUTOCOMPLETE_LIMIT):
+    names = name_index.search(prefix, limit)
+    if names is None:
+        # catalog too large to keep in memory, prefix index on UPPER(name) serves the lookup
+        names = search_database(prefix, limit)
+    return names
+
+
+def search_database(prefix, limit):
+    return list(
+        Product.objects.filter(name__istartswith=prefix)
+        .order_by(Upper('name'), 'name').values_list('name', flat=True).distinct()[:limit]
+    )
+
+
+def fold_case(prefix):
+    # prefixes are folded like the names, by the database's UPPER(): python's str.upper() differs for
+    # some letters (e.g. 'ß'), only ascii text is folded in python, where both agree
+    if prefix.isascii():
+        return prefix.upper()
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT UPPER(%s)', [prefix])
+        return cursor.fetchone()[0]
+
+
+def get_autocomplete_limit(params):
+    return get_limit(params, 'limit', AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT)
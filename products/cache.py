@@ -0,0 +1,95 @@
+import hashlib
+import json
+import time
+from django.conf import settings
+from django.core.cache import cache
+
+
+# every cached listing key embeds the current generation, bumping it invalidates all of them at once
+GENERATION_KEY = 'products:listing:generation'
+HITS_KEY = 'products:listing:hits'
+MISSES_KEY = 'products:listing:misses'
+
+# query parameters that change the listing's content
+LISTING_PARAMS = (
+    'page', 'page_size', 'pagination', 'cursor', 'count',
+    'min_price', 'max_price', 'search', 'tags', 'tags_mode', 'facets', 'facet_limit'
+)
+
+
+def get_counter(key):
+    value = cache.get(key)
+    if value is None:
+        # starting from a timestamp, so an evicted counter never goes back to an older value
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        value = cache.get(key)
+    return value
+
+
+def increment_counter(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_counter(key)
+        return cache.incr(key)
+
+
+def get_generation():
+    return get_counter(GENERATION_KEY)
+
+
+def invalidate_product_listings():
+    # called after every write to products
+    increment_counter(GENERATION_KEY)
+
+
+def normalize_listing_params(params):
+    # equivalent queries (parameter order, tag order, letter case of search) share one key
+    normalized = {}
+    for name in LISTING_PARAMS:
+        value = params.get(name, '').strip()
+        if not value:
+            continue
+        if name == 'tags':
+            value = ','.join(sorted({tag.strip() for tag in value.split(',') if tag.strip()}))
+        elif name == 'search':
+            value = ' '.join(value.lower().split())
+        normalized[name] = value
+    return normalized
+
+
+def listing_cache_key(request):
+    # links in paginated responses are absolute, so the host is part of the key
+    payload = json.dumps([request.get_host(), normalize_listing_params(request.GET)], sort_keys=True)
+    digest = hashlib.sha256(payload.encode()).hexdigest()
+    return f'products:listing:{get_generation()}:{digest}'
+
+
+def get_cached_listing(key):
+    data = cache.get(key)
+    _increment(HITS_KEY if data is not None else MISSES_KEY)
+    return data
+
+
+def cache_listing(key, data):
+    cache.set(key, data, timeout=settings.PRODUCT_LISTING_CACHE_TTL)
+
+
+def get_listing_cache_stats():
+    hits = cache.get(HITS_KEY) or 0
+    misses = cache.get(MISSES_KEY) or 0
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else None,
+        'generation': cache.get(GENERATION_KEY),
+        'ttl': settings.PRODUCT_LISTING_CACHE_TTL,
+    }
+
+
+def _increment(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
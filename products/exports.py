@@ -0,0 +1,49 @@
+import csv
+import json
+
+
+EXPORT_FIELDS = ('id', 'name', 'description', 'price', 'stock', 'tags', 'created_at')
+CHUNK_SIZE = 2000
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class Echo:
+    # file-like object for csv writer, returning written line instead of buffering it
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    # streaming plain tuples through a server-side cursor, without building model instances
+    return queryset.order_by('pk').values_list(*EXPORT_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def encode_ndjson(rows):
+    for pk, name, description, price, stock, tags, created_at in rows:
+        yield json.dumps({
+            'id': pk,
+            'name': name,
+            'description': description,
+            'price': format(price, 'f'),
+            'stock': stock,
+            'tags': tags,
+            'created_at': created_at.isoformat(),
+        }) + '\n'
+
+
+def encode_csv(rows):
+    # same columns as accepted by bulk import, so an export can be imported back
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for pk, name, description, price, stock, tags, created_at in rows:
+        yield writer.writerow([pk, name, description, format(price, 'f'), stock, ','.join(tags), created_at.isoformat()])
+
+
+ENCODERS = {
+    'ndjson': encode_ndjson,
+    'csv': encode_csv,
+}
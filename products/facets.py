@@ -0,0 +1,24 @@
+from django.db import connections
+from .params import get_limit
+
+
+FACET_LIMIT = 10
+MAX_FACET_LIMIT = 50
+
+
+def tag_facets(queryset, limit=FACET_LIMIT):
+    # counting tags of the filtered products in a single aggregate query
+    tags = queryset.order_by().values('tags')
+    sql, params = tags.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(
+            f'SELECT tag, COUNT(*) AS count '
+            f'FROM ({sql}) AS filtered, unnest(filtered.tags) AS tag '
+            f'GROUP BY tag ORDER BY count DESC, tag LIMIT %s',
+            [*params, limit]
+        )
+        return [{'tag': tag, 'count': count} for tag, count in cursor.fetchall()]
+
+
+def get_facet_limit(params):
+    return get_limit(params, 'facet_limit', FACET_LIMIT, MAX_FACET_LIMIT)
@@ -0,0 +1,112 @@
+import codecs
+import csv
+import json
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .models import Product
+from .serializers import ProductSerializer
+from .rollups import snapshot, update_rollups
+from .autocomplete import record_name_changes
+
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+CSV_CONTENT_TYPES = ('text/csv',)
+NDJSON_CONTENT_TYPES = ('application/x-ndjson', 'application/ndjson', 'application/jsonl')
+
+
+class ImportReport:
+    # counters and a bounded list of per-row errors, so memory stays flat for any upload size
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row, errors):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'row': row, 'errors': errors})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+def is_supported(content_type):
+    return content_type in CSV_CONTENT_TYPES or content_type in NDJSON_CONTENT_TYPES
+
+
+def iter_rows(stream, content_type):
+    # decoding the upload line by line, without reading the whole body into memory
+    lines = codecs.iterdecode(stream, 'utf-8')
+    reader = csv.DictReader(lines) if content_type in CSV_CONTENT_TYPES else None
+    number = 0
+
+    try:
+        if reader is not None:
+            for row in reader:
+                yield reader.line_num, parse_csv_row(row)
+        else:
+            for number, line in enumerate(lines, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield number, json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield number, error
+    except UnicodeDecodeError as error:
+        # nothing after a line that is not utf-8 can be read, it is reported as the last row
+        yield (reader.line_num if reader is not None else number) + 1, error
+
+
+def parse_csv_row(row):
+    # empty cells fall back to model defaults, tags are comma separated inside one cell
+    data = {key: value for key, value in row.items() if key and value not in (None, '')}
+    if 'tags' in data:
+        data['tags'] = [tag.strip() for tag in data['tags'].split(',') if tag.strip()]
+    return data
+
+
+def import_products(stream, content_type, seller, batch_size=BATCH_SIZE):
+    # validating rows through product serializer and inserting valid ones in batches,
+    # one serializer instance is reused so its fields are only built once per upload
+    report = ImportReport()
+    validator = ProductSerializer()
+    batch = []
+
+    for number, data in iter_rows(stream, content_type):
+        if isinstance(data, json.JSONDecodeError):
+            report.add_error(number, {'non_field_errors': [f'Invalid JSON: {data.msg}.']})
+            continue
+        if isinstance(data, UnicodeDecodeError):
+            report.add_error(number, {'non_field_errors': ['File is not valid UTF-8.']})
+            continue
+
+        try:
+            validated_data = validator.run_validation(data)
+        except ValidationError as error:
+            report.add_error(number, error.detail)
+            continue
+
+        batch.append(Product(seller=seller, **validated_data))
+        if len(batch) >= batch_size:
+            report.created += _insert_batch(batch)
+            batch = []
+
+    if batch:
+        report.created += _insert_batch(batch)
+    return report
+
+
+def _insert_batch(batch):
+    # one transaction per batch keeps locks short and earlier batches committed
+    with transaction.atomic():
+        Product.objects.bulk_create(batch)
+        update_rollups(added=[snapshot(product) for product in batch])
+    record_name_changes([product.name for product in batch])
+    return len(batch)
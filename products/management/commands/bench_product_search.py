@@ -0,0 +1,113 @@
+import statistics
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from users.models import CustomUser
+from products.models import Product
+from products.search import search_products
+
+
+BENCH_USERNAME = 'bench_search_seller'
+
+# vocabulary used to generate product names and descriptions
+WORDS = [
+    'wireless', 'keyboard', 'mouse', 'monitor', 'laptop', 'stand', 'cable', 'charger',
+    'notebook', 'pencil', 'backpack', 'bottle', 'lamp', 'desk', 'chair', 'headphones',
+    'speaker', 'camera', 'lens', 'tripod', 'battery', 'adapter', 'hub', 'router',
+    'ergonomic', 'portable', 'compact', 'premium', 'classic', 'stylish', 'durable', 'mechanical',
+    'leather', 'steel', 'wooden', 'plastic', 'cotton', 'glass', 'bamboo', 'ceramic',
+    'black', 'white', 'silver', 'blue', 'green', 'red', 'grey', 'gold',
+    'mini', 'pro', 'max', 'lite', 'ultra', 'smart', 'travel', 'office',
+]
+
+SEED_SQL = """
+INSERT INTO products_product (seller_id, name, description, price, stock, tags, created_at, updated_at)
+SELECT %(seller)s,
+       w[1 + (i * 7) %% n] || ' ' || w[1 + (i * 13) %% n] || ' ' || w[1 + (i * 31) %% n],
+       w[1 + (i * 3) %% n] || ' ' || w[1 + (i * 17) %% n] || ' ' || w[1 + (i * 23) %% n] || ' '
+           || w[1 + (i * 29) %% n] || ' ' || w[1 + (i * 37) %% n] || ' for everyday use',
+       round((random() * 500)::numeric, 2),
+       (random() * 100)::int,
+       '{}',
+       now() - (i || ' seconds')::interval,
+       now() - (i || ' seconds')::interval
+FROM generate_series(%(start)s, %(stop)s) AS i,
+     (SELECT %(words)s::text[] AS w, %(count)s AS n) AS vocabulary
+"""
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks full-text product search against the legacy icontains filter'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100_000, 1_000_000, 5_000_000])
+        parser.add_argument('--query', default='wireless keyboard')
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--chunk-size', type=int, default=250_000)
+        parser.add_argument('--keep', action='store_true', help='keep generated products after the run')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Search benchmark requires PostgreSQL.')
+
+        seller, created = CustomUser.objects.get_or_create(
+            username=BENCH_USERNAME,
+            defaults={'email': f'{BENCH_USERNAME}@example.com', 'first_name': 'Bench', 'last_name': 'Seller'}
+        )
+        query = options['query']
+
+        try:
+            # growing the catalog step by step and measuring both filters at every size
+            seeded = Product.objects.filter(seller=seller).count()
+            for size in sorted(options['sizes']):
+                if size > seeded:
+                    self.seed(seller, seeded, size, options['chunk_size'])
+                    seeded = size
+
+                legacy = self.measure(self.legacy_queryset(query), options['repeat'])
+                indexed = self.measure(search_products(Product.objects.order_by('-created_at'), query), options['repeat'])
+                self.stdout.write(
+                    f'{size:>10,} products | icontains {legacy:10.2f} ms | full-text {indexed:10.2f} ms | '
+                    f'speedup x{legacy / indexed if indexed else float("inf"):.1f}'
+                )
+        finally:
+            if not options['keep']:
+                # deleting in sql to avoid collecting millions of objects in memory
+                with connection.cursor() as cursor:
+                    cursor.execute('DELETE FROM products_product WHERE seller_id = %s', [seller.pk])
+                seller.delete()
+
+    def seed(self, seller, start, stop, chunk_size):
+        # generating products inside postgres, search vectors are filled by the trigger
+        with connection.cursor() as cursor:
+            for chunk_start in range(start, stop, chunk_size):
+                chunk_stop = min(chunk_start + chunk_size, stop)
+                cursor.execute(SEED_SQL, {
+                    'seller': seller.pk,
+                    'start': chunk_start + 1,
+                    'stop': chunk_stop,
+                    'words': WORDS,
+                    'count': len(WORDS),
+                })
+                self.stdout.write(f'  seeded {chunk_stop:,} products', ending='\r')
+                self.stdout.flush()
+            cursor.execute('ANALYZE products_product')
+        self.stdout.write('')
+
+    def legacy_queryset(self, query):
+        # filter used by product listings before the search index existed
+        return Product.objects.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query)
+        ).order_by('-created_at')
+
+    def measure(self, queryset, repeat):
+        # timing what a listing request does: counting matches and fetching the first page
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            queryset.count()
+            list(queryset[:10])
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
@@ -0,0 +1,58 @@
+import datetime
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from products.models import Product
+from products.serializers import ProductSerializer, PRODUCT_READ_PLAN
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks ProductSerializer against the compiled product read plan (rows per second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        # building in-memory products and matching .values() rows, no database required
+        created_at = datetime.datetime(2025, 1, 1, tzinfo=datetime.timezone.utc)
+        products = [
+            Product(
+                id=number,
+                seller_id=1,
+                name=f'Product {number}',
+                description='Stylish notebook of 240 A4 pages for sketching',
+                price=Decimal(number % 1000) + Decimal('0.49'),
+                stock=number % 50,
+                tags=['stationery', 'paper'],
+                created_at=created_at,
+                updated_at=created_at
+            )
+            for number in range(options['rows'])
+        ]
+        rows = [{field: getattr(product, field) for field in PRODUCT_READ_PLAN.fields} for product in products]
+
+        # the fast path must render exactly the same output
+        expected = [dict(item) for item in ProductSerializer(products, many=True).data]
+        if PRODUCT_READ_PLAN.serialize(products) != expected or PRODUCT_READ_PLAN.serialize(rows) != expected:
+            raise CommandError('Read plan output differs from ProductSerializer.')
+
+        results = [
+            ('ProductSerializer(many=True)', lambda: ProductSerializer(products, many=True).data),
+            ('read plan, model instances', lambda: PRODUCT_READ_PLAN.serialize(products)),
+            ('read plan, .values() rows', lambda: PRODUCT_READ_PLAN.serialize(rows)),
+        ]
+        baseline = None
+        for label, serialize in results:
+            rate = self.measure(serialize, len(products), options['repeat'])
+            baseline = baseline or rate
+            self.stdout.write(f'{label:<30} {rate:>12,.0f} rows/s   x{rate / baseline:.1f}')
+
+    def measure(self, serialize, count, repeat):
+        # best of several runs
+        best = float('inf')
+        for _ in range(repeat):
+            started = time.perf_counter()
+            serialize()
+            best = min(best, time.perf_counter() - started)
+        return count / best
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the price rollup behind catalog statistics from the products table'
+
+    def handle(self, *args, **options):
+        rows = rebuild_rollups()
+        self.stdout.write(self.style.SUCCESS(f'Price rollup rebuilt with {rows} rows.'))
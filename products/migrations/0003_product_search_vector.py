@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:51
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+import django.contrib.postgres.search
+from django.conf import settings
+from django.db import migrations
+
+
+BATCH_SIZE = 10_000
+
+
+SEARCH_VECTOR_SQL = """
+CREATE OR REPLACE FUNCTION products_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', coalesce(NEW.name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(NEW.description, '')), 'B');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER products_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description ON products_product
+    FOR EACH ROW EXECUTE FUNCTION products_product_search_vector_update();
+"""
+
+# touching the name fires the trigger, which fills the vector of existing rows
+BACKFILL_SEARCH_VECTOR_SQL = """
+UPDATE products_product SET name = name
+WHERE id > %s AND id <= %s AND search_vector IS NULL
+"""
+
+DROP_SEARCH_VECTOR_SQL = """
+DROP TRIGGER IF EXISTS products_product_search_vector_trigger ON products_product;
+DROP FUNCTION IF EXISTS products_product_search_vector_update();
+"""
+
+
+def backfill_search_vector(apps, schema_editor):
+    # existing products are filled in short batches by id range, each committed on its own,
+    # so the table is never locked as a whole; products written meanwhile are filled by the trigger
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM products_product')
+        last_id = cursor.fetchone()[0]
+        for start in range(0, last_id, BATCH_SIZE):
+            cursor.execute(BACKFILL_SEARCH_VECTOR_SQL, [start, start + BATCH_SIZE])
+
+
+class Migration(migrations.Migration):
+    # indexes are built concurrently and the backfill commits per batch, outside one big transaction
+    atomic = False
+
+    dependencies = [
+        ('products', '0002_product_tags'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(sql=SEARCH_VECTOR_SQL, reverse_sql=DROP_SEARCH_VECTOR_SQL),
+        migrations.RunPython(backfill_search_vector, reverse_code=migrations.RunPython.noop),
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+        ),
+    ]
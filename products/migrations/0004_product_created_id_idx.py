@@ -0,0 +1,21 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:53
+
+import django.contrib.postgres.operations
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0003_product_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:53
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.operations
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0004_product_created_id_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['tags'], name='product_tags_gin'),
+        ),
+    ]
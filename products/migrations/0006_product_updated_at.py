@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_tags_gin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(
+            sql='UPDATE products_product SET updated_at = created_at',
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
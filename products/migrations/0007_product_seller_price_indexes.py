@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:00
+
+import django.contrib.postgres.operations
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0006_product_updated_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['seller', '-created_at'], name='product_seller_created_idx'),
+        ),
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(fields=['price'], name='product_price_idx'),
+        ),
+    ]
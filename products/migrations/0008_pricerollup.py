@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:03
+
+from django.db import migrations, models
+
+
+POPULATE_ROLLUP_SQL = """
+INSERT INTO products_pricerollup (seller_id, tag, price, product_count, stock_total)
+SELECT scope.seller_id, scope.tag, product.price, COUNT(*), SUM(product.stock)
+FROM products_product AS product
+CROSS JOIN LATERAL (
+    SELECT 0::bigint AS seller_id, ''::varchar AS tag
+    UNION ALL SELECT product.seller_id, ''
+    UNION ALL SELECT 0, tag FROM (SELECT DISTINCT unnest(product.tags) AS tag) AS tags
+    UNION ALL SELECT product.seller_id, tag FROM (SELECT DISTINCT unnest(product.tags) AS tag) AS tags
+) AS scope
+GROUP BY scope.seller_id, scope.tag, product.price
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_product_seller_price_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PriceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seller_id', models.BigIntegerField(default=0)),
+                ('tag', models.CharField(blank=True, default='', max_length=32)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('product_count', models.IntegerField(default=0)),
+                ('stock_total', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('seller_id', 'tag', 'price'), name='price_rollup_scope_price_unique')],
+            },
+        ),
+        migrations.RunSQL(sql=POPULATE_ROLLUP_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:05
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+import django.contrib.postgres.operations
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('products', '0008_pricerollup'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        django.contrib.postgres.operations.AddIndexConcurrently(
+            model_name='product',
+            index=models.Index(django.contrib.postgres.indexes.OpClass(django.db.models.functions.text.Upper(django.db.models.functions.comparison.Cast('name', models.TextField())), name='text_pattern_ops'), name='product_name_prefix_idx'),
+        ),
+    ]
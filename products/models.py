@@ -1,6 +1,9 @@
 from django.db import models
 from users.models import CustomUser
 from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Cast, Upper
 
 
 class Product(models.Model):
@@ -11,4 +14,33 @@ class Product(models.Model):
     stock = models.PositiveIntegerField(default=0)
     tags = ArrayField(models.CharField(max_length=32), blank=True, default=list)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
+    # weighted tsvector of name and description, maintained by a database trigger
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_gin'),
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            GinIndex(fields=['tags'], name='product_tags_gin'),
+            models.Index(fields=['seller', '-created_at'], name='product_seller_created_idx'),
+            models.Index(fields=['price'], name='product_price_idx'),
+            # prefix index on the expression used by name__istartswith lookups (autocomplete)
+            models.Index(OpClass(Upper(Cast('name', models.TextField())), name='text_pattern_ops'), name='product_name_prefix_idx'),
+        ]
+
+
+class PriceRollup(models.Model):
+    # number of products and their stock per price, for every seller and tag scope,
+    # seller_id 0 and empty tag stand for "all sellers" and "all tags"
+    seller_id = models.BigIntegerField(default=0)
+    tag = models.CharField(max_length=32, blank=True, default='')
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    product_count = models.IntegerField(default=0)
+    stock_total = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['seller_id', 'tag', 'price'], name='price_rollup_scope_price_unique'),
+        ]
@@ -0,0 +1,7 @@
+def get_limit(params, name, default, maximum):
+    # reading a limit from query parameters, falling back to default on invalid values
+    try:
+        limit = int(params.get(name, default))
+    except ValueError:
+        return default
+    return min(max(limit, 1), maximum)
@@ -0,0 +1,126 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import connection, transaction
+from django.db.models import F, Func, IntegerField, Max, Min, Sum, Value
+from django.db.models.functions import Least
+from .models import PriceRollup
+
+
+MAX_BUCKETS = 50
+
+# same statement as migration 0008, used to rebuild the rollup from scratch
+POPULATE_ROLLUP_SQL = """
+INSERT INTO products_pricerollup (seller_id, tag, price, product_count, stock_total)
+SELECT scope.seller_id, scope.tag, product.price, COUNT(*), SUM(product.stock)
+FROM products_product AS product
+CROSS JOIN LATERAL (
+    SELECT 0::bigint AS seller_id, ''::varchar AS tag
+    UNION ALL SELECT product.seller_id, ''
+    UNION ALL SELECT 0, tag FROM (SELECT DISTINCT unnest(product.tags) AS tag) AS tags
+    UNION ALL SELECT product.seller_id, tag FROM (SELECT DISTINCT unnest(product.tags) AS tag) AS tags
+) AS scope
+GROUP BY scope.seller_id, scope.tag, product.price
+"""
+
+UPSERT_ROLLUP_SQL = """
+INSERT INTO products_pricerollup (seller_id, tag, price, product_count, stock_total)
+VALUES {values}
+ON CONFLICT (seller_id, tag, price) DO UPDATE SET
+    product_count = products_pricerollup.product_count + EXCLUDED.product_count,
+    stock_total = products_pricerollup.stock_total + EXCLUDED.stock_total
+RETURNING id, product_count
+"""
+
+# rows stay locked by the upsert until commit, so a price left without products can be dropped safely
+DELETE_EMPTY_ROLLUPS_SQL = 'DELETE FROM products_pricerollup WHERE id = ANY(%s) AND product_count = 0'
+
+
+def snapshot(product):
+    # the part of a product the rollup depends on, taken before and after changes
+    return (product.seller_id, product.price, product.stock, tuple(product.tags))
+
+
+def update_rollups(added=(), removed=()):
+    # applying products' contributions to every scope they belong to with a single upsert,
+    # must run in the same transaction as the products' write
+    deltas = defaultdict(lambda: [0, 0])
+    for sign, snapshots in ((1, added), (-1, removed)):
+        for seller_id, price, stock, tags in snapshots:
+            price = Decimal(price).quantize(Decimal('0.01'))
+            for scope in _scopes(seller_id, tags):
+                delta = deltas[(*scope, price)]
+                delta[0] += sign
+                delta[1] += sign * stock
+
+    # rows are upserted in key order, so concurrent writers lock them in the same order and cannot deadlock
+    rows = sorted((*key, count, stock) for key, (count, stock) in deltas.items() if count or stock)
+    if not rows:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_ROLLUP_SQL.format(values=', '.join(['(%s, %s, %s, %s, %s)'] * len(rows))),
+            [value for row in rows for value in row]
+        )
+        empty = [pk for pk, product_count in cursor.fetchall() if not product_count]
+        if empty:
+            cursor.execute(DELETE_EMPTY_ROLLUPS_SQL, [empty])
+
+
+def _scopes(seller_id, tags):
+    yield 0, ''
+    yield seller_id, ''
+    for tag in set(tags):
+        yield 0, tag
+        yield seller_id, tag
+
+
+def rebuild_rollups():
+    # recomputing the rollup from products, writers wait until it is done
+    with transaction.atomic():
+        with connection.cursor() as cursor:
+            cursor.execute('LOCK TABLE products_product IN SHARE MODE')
+            cursor.execute('DELETE FROM products_pricerollup')
+            cursor.execute(POPULATE_ROLLUP_SQL)
+            return cursor.rowcount
+
+
+def catalog_stats(seller_id=0, tag='', buckets=10):
+    # summary and price histogram of a scope, read from the rollup only
+    rows = PriceRollup.objects.filter(seller_id=seller_id, tag=tag, product_count__gt=0)
+    summary = rows.aggregate(
+        products=Sum('product_count'),
+        stock_total=Sum('stock_total'),
+        min_price=Min('price'),
+        max_price=Max('price'),
+        price_total=Sum(F('price') * F('product_count'))
+    )
+    if not summary['products']:
+        return {'products': 0, 'stock_total': 0, 'min_price': None, 'max_price': None, 'avg_price': None, 'buckets': []}
+
+    # counting products per equal-width price range, the highest price falls into the last one
+    min_price, max_price = summary['min_price'], summary['max_price']
+    if min_price == max_price:
+        buckets = 1
+        counts = {1: summary['products']}
+    else:
+        counts = dict(rows.annotate(bucket=Least(
+            Func(F('price'), Value(min_price), Value(max_price), Value(buckets), function='width_bucket', output_field=IntegerField()),
+            Value(buckets)
+        )).values('bucket').annotate(count=Sum('product_count')).values_list('bucket', 'count'))
+
+    width = (max_price - min_price) / buckets
+    return {
+        'products': summary['products'],
+        'stock_total': summary['stock_total'],
+        'min_price': str(min_price),
+        'max_price': str(max_price),
+        'avg_price': str((summary['price_total'] / summary['products']).quantize(Decimal('0.01'))),
+        'buckets': [
+            {
+                'min_price': str((min_price + width * number).quantize(Decimal('0.01'))),
+                'max_price': str((min_price + width * (number + 1)).quantize(Decimal('0.01'))),
+                'count': counts.get(number + 1, 0),
+            }
+            for number in range(buckets)
+        ],
+    }
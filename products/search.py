@@ -0,0 +1,47 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+
+
+# text search configuration used by the search vector trigger (see migration 0003)
+SEARCH_CONFIG = 'english'
+
+
+def search_products(queryset, query, rank=True):
+    # full-text search on postgres, term matching on any other backend
+    if connections[queryset.db].vendor == 'postgresql':
+        return _search_postgres(queryset, query, rank)
+    return _search_fallback(queryset, query, rank)
+
+
+def _search_postgres(queryset, query, rank):
+    # matching against the indexed tsvector column instead of scanning with ILIKE
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    queryset = queryset.filter(search_vector=search_query)
+
+    # ordering by relevance, newest products first among equals
+    if rank:
+        queryset = queryset.annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-created_at')
+    return queryset
+
+
+def _search_fallback(queryset, query, rank):
+    # local engine for databases without full-text search (e.g. sqlite test runs):
+    # every term must appear in the name or description
+    terms = query.split()
+    for term in terms:
+        queryset = queryset.filter(Q(name__icontains=term) | Q(description__icontains=term))
+
+    # mimicking the weights of the search vector: name matches count more than description ones
+    if rank and terms:
+        score = Value(0)
+        for term in terms:
+            score = score + Case(
+                When(name__icontains=term, then=Value(2)),
+                default=Value(1),
+                output_field=IntegerField()
+            )
+        queryset = queryset.annotate(rank=score).order_by('-rank', '-created_at')
+    return queryset
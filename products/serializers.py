@@ -1,8 +1,132 @@
+import decimal
+import functools
+from decimal import Decimal
+from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
 from rest_framework import serializers
+from rest_framework.settings import api_settings, ISO_8601
 from .models import Product
 
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta():
         model = Product
-        exclude = ['seller', 'created_at']
\ No newline at end of file
+        exclude = ['seller', 'created_at', 'updated_at', 'search_vector']
+
+
+class ReadPlan:
+    # read-only counterpart of a model serializer: the field list and one converter per field
+    # are compiled once, then rows are turned into dictionaries without per-field serializer calls
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+
+    @cached_property
+    def plan(self):
+        fields = self.serializer_class().fields
+        return tuple(
+            (name, _converter_for(field))
+            for name, field in fields.items() if not field.write_only
+        )
+
+    @cached_property
+    def fields(self):
+        return tuple(name for name, converter in self.plan)
+
+    def to_representation(self, instance):
+        # from model instance
+        return {
+            name: None if (value := getattr(instance, name)) is None else converter(value)
+            for name, converter in self.plan
+        }
+
+    def from_values(self, row):
+        # from dictionary returned by .values()
+        return {
+            name: None if (value := row[name]) is None else converter(value)
+            for name, converter in self.plan
+        }
+
+    def serialize(self, rows):
+        if not rows:
+            return []
+        convert = self.from_values if isinstance(rows[0], dict) else self.to_representation
+        return [convert(row) for row in rows]
+
+
+def _converter_for(field):
+    # producing exactly what the field's to_representation() returns, but cheaper
+    if (isinstance(field, serializers.DecimalField) and field.decimal_places is not None
+            and getattr(field, 'coerce_to_string', api_settings.COERCE_DECIMAL_TO_STRING)
+            and not field.localize and not field.normalize_output):
+        context = decimal.getcontext().copy()
+        if field.max_digits is not None:
+            context.prec = field.max_digits
+        return functools.partial(
+            _decimal_to_string,
+            exponent=Decimal('.1') ** field.decimal_places,
+            rounding=field.rounding,
+            context=context
+        )
+    if isinstance(field, serializers.DateTimeField) and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601:
+        return _datetime_to_iso
+    if isinstance(field, (serializers.IntegerField, serializers.CharField, serializers.BooleanField)):
+        return _identity
+    if isinstance(field, serializers.ListField) and isinstance(field.child, (serializers.CharField, serializers.IntegerField)):
+        return list
+    if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+        return _related_pk
+    return field.to_representation
+
+
+def _identity(value):
+    return value
+
+
+def _related_pk(value):
+    # related instance, or its primary key as .values() returns it
+    return getattr(value, 'pk', value)
+
+
+def _decimal_to_string(value, exponent, rounding, context):
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value).strip())
+    return format(value.quantize(exponent, rounding=rounding, context=context), 'f')
+
+
+def _datetime_to_iso(value):
+    # same as rest framework: current time zone, 'Z' suffix for utc
+    if settings.USE_TZ:
+        value = timezone.localtime(value) if timezone.is_aware(value) else timezone.make_aware(value)
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+# compiled plan for product's public representation
+PRODUCT_READ_PLAN = ReadPlan(ProductSerializer)
+
+
+class ProductReadField(serializers.Field):
+    # nested product for cart and order serializers, rendered with the compiled plan
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return PRODUCT_READ_PLAN.to_representation(value)
+
+
+class ProductUpdateOperationSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, required=False)
+    stock = serializers.IntegerField(min_value=0, max_value=2147483647, required=False)
+    stock_delta = serializers.IntegerField(min_value=-2147483647, max_value=2147483647, required=False)
+
+    def validate(self, attrs):
+        if 'stock' in attrs and 'stock_delta' in attrs:
+            raise serializers.ValidationError("Use either 'stock' or 'stock_delta', not both.")
+        if not any(field in attrs for field in ('price', 'stock', 'stock_delta')):
+            raise serializers.ValidationError("At least one of 'price', 'stock' or 'stock_delta' is required.")
+        return attrs
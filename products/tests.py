@@ -1,3 +1,545 @@
-from django.test import TestCase
+import csv
+import io
+import json
+import threading
+from decimal import Decimal
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from ecommerce_api.testing import create_user, CachedAPITestCase, QueryPlanTestMixin
+from users.models import CustomUser
+from .models import Product, PriceRollup
+from .search import SEARCH_CONFIG, search_products, _search_fallback
+from .cache import get_listing_cache_stats
+from .imports import import_products
+from .rollups import snapshot, update_rollups, rebuild_rollups, catalog_stats
+from .updates import apply_product_updates
+from .serializers import ProductSerializer, ReadPlan, PRODUCT_READ_PLAN
+from .facets import get_facet_limit, FACET_LIMIT, MAX_FACET_LIMIT
+from .autocomplete import NameIndex, record_name_changes, search_database
 
-# Create your tests here.
+
+class ProductQueryPlanTests(QueryPlanTestMixin, TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        sellers = [create_user(f'plan_seller_{number}') for number in range(20)]
+        tags = ['stationery', 'paper', 'office', 'kitchen', 'garden', 'tools', 'toys', 'books']
+        Product.objects.bulk_create([
+            Product(
+                seller=sellers[number % len(sellers)],
+                name=f'Product {number} notebook' if number % 50 == 0 else f'Product {number}',
+                description='Realistic description of a product for the query plan test.',
+                price=Decimal(number % 500) + Decimal('0.99'),
+                stock=number % 30,
+                tags=[tags[number % len(tags)], tags[(number * 3) % len(tags)]]
+            )
+            for number in range(5000)
+        ], batch_size=1000)
+        cls.seller = sellers[0]
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE products_product')
+
+    def test_seller_products_ordered_by_creation(self):
+        self.assertUsesIndex(
+            Product.objects.filter(seller=self.seller).order_by('-created_at')[:10], 'product_seller_created_idx', ordered=True
+        )
+
+    def test_price_range(self):
+        self.assertUsesIndex(Product.objects.filter(price__gte=100, price__lte=120), 'product_price_idx')
+
+    def test_catalog_keyset_page(self):
+        last = Product.objects.order_by('-created_at', '-id')[2500]
+        self.assertUsesIndex(
+            Product.objects.filter(created_at__lte=last.created_at).order_by('-created_at', '-id')[:10],
+            'product_created_id_idx', ordered=True
+        )
+
+    def test_full_text_search(self):
+        query = SearchQuery('notebook', config=SEARCH_CONFIG, search_type='websearch')
+        self.assertUsesIndex(Product.objects.filter(search_vector=query), 'product_search_vector_gin')
+
+    def test_tags_overlap(self):
+        self.assertUsesIndex(Product.objects.filter(tags__overlap=['garden', 'toys']), 'product_tags_gin')
+
+    def test_name_prefix(self):
+        self.assertUsesIndex(
+            Product.objects.filter(name__istartswith='product 12').values_list('name', flat=True), 'product_name_prefix_idx'
+        )
+
+
+@override_settings(AUTOCOMPLETE_REFRESH_INTERVAL=0)
+class AutocompleteTests(CachedAPITestCase):
+    def setUp(self):
+        super().setUp()
+        self.seller = create_user('autocomplete_seller')
+        self.index = NameIndex()
+        for name in ['Notebook', 'notepad', 'Pencil']:
+            Product.objects.create(seller=self.seller, name=name, description='-', price=1, stock=1)
+
+    def test_prefix_ignores_case(self):
+        self.assertEqual(self.index.search('NOTE', 10), ['Notebook', 'notepad'])
+        self.assertEqual(self.index.search('note', 1), ['Notebook'])
+        self.assertEqual(self.index.search('x', 10), [])
+
+    def test_changes_are_replayed(self):
+        self.index.search('note', 10)
+        Product.objects.filter(name='notepad').update(name='Pen')
+        Product.objects.create(seller=self.seller, name='Note cards', description='-', price=1, stock=1)
+        record_name_changes(['notepad', 'Pen'])
+        record_name_changes(['Note cards'])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.search('note', 10), ['Note cards', 'Notebook'])
+        self.assertEqual(self.index.search('pe', 10), ['Pen', 'Pencil'])
+
+    def test_case_is_folded_by_database(self):
+        for name in ['Straße', 'STRASSE sign', 'Éclair']:
+            Product.objects.create(seller=self.seller, name=name, description='-', price=1, stock=1)
+        for prefix in ['straß', 'STRASS', 'éc', 'ÉCL', 'note']:
+            with self.subTest(prefix=prefix):
+                self.assertEqual(self.index.search(prefix, 10), search_database(prefix, 10))
+        self.assertEqual(self.index.search('note', 10), ['Notebook', 'notepad'])
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('search_seller')
+        for name, description in [
+            ('Desk lamp', 'Bright lamp with a wireless charger in its base'),
+            ('Wireless keyboard', 'Compact keyboard for travel'),
+            ('Wireless mouse', 'Quiet mouse'),
+            ('Office chair', 'Ergonomic chair'),
+        ]:
+            Product.objects.create(seller=seller, name=name, description=description, price=10, stock=5)
+
+    def names(self, queryset):
+        return list(queryset.values_list('name', flat=True))
+
+    def test_name_matches_rank_first(self):
+        # both words in the name beat a description-only match, newest first among equals
+        self.assertEqual(
+            self.names(search_products(Product.objects.all(), 'wireless')),
+            ['Wireless mouse', 'Wireless keyboard', 'Desk lamp']
+        )
+        self.assertEqual(self.names(search_products(Product.objects.all(), 'wireless keyboards')), ['Wireless keyboard'])
+
+    def test_web_search_syntax(self):
+        self.assertEqual(self.names(search_products(Product.objects.all(), 'wireless -mouse')), ['Wireless keyboard', 'Desk lamp'])
+        self.assertEqual(self.names(search_products(Product.objects.all(), '"office chair" OR lamp')), ['Office chair', 'Desk lamp'])
+
+    def test_unranked_search_keeps_ordering(self):
+        queryset = search_products(Product.objects.order_by('name'), 'wireless', rank=False)
+        self.assertEqual(self.names(queryset), ['Desk lamp', 'Wireless keyboard', 'Wireless mouse'])
+
+    def test_fallback_matches_every_term(self):
+        queryset = Product.objects.all()
+        self.assertEqual(self.names(_search_fallback(queryset, 'WIRELESS', rank=True)), ['Wireless mouse', 'Wireless keyboard', 'Desk lamp'])
+        self.assertEqual(self.names(_search_fallback(queryset, 'wireless lamp', rank=True)), ['Desk lamp'])
+        self.assertEqual(self.names(_search_fallback(queryset, 'printer', rank=True)), [])
+
+
+class CursorPaginationTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cursor_reader')
+        cls.products = [
+            Product.objects.create(seller=cls.user, name=f'Product {number}', description='-', price=1, stock=1)
+            for number in range(5)
+        ]
+        # products created at the same moment are told apart by id
+        Product.objects.update(created_at=timezone.now())
+
+    def ids(self, response):
+        return [product['id'] for product in response.data['results']]
+
+    def test_next_and_previous_pages(self):
+        expected = [product.pk for product in reversed(self.products)]
+
+        first = self.client.get('/products/all/', {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(self.ids(first), expected[:2])
+        self.assertIsNone(first.data['previous'])
+
+        second = self.client.get(first.data['next'])
+        self.assertEqual(self.ids(second), expected[2:4])
+
+        last = self.client.get(second.data['next'])
+        self.assertEqual(self.ids(last), expected[4:])
+        self.assertIsNone(last.data['next'])
+
+        previous = self.client.get(last.data['previous'])
+        self.assertEqual(self.ids(previous), expected[2:4])
+        self.assertIsNotNone(previous.data['next'])
+
+    def test_count_on_demand(self):
+        response = self.client.get('/products/all/', {'pagination': 'cursor', 'page_size': 2})
+        self.assertNotIn('count', response.data)
+        response = self.client.get('/products/all/', {'pagination': 'cursor', 'page_size': 2, 'count': 'true'})
+        self.assertEqual(response.data['count'], 5)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/products/all/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+
+class TagFilterTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('tag_reader')
+        for name, tags in [
+            ('Notebook', ['paper', 'office']),
+            ('Pencil', ['office']),
+            ('Spade', ['garden', 'tools']),
+            ('Hammer', ['tools']),
+        ]:
+            Product.objects.create(seller=cls.user, name=name, description='-', price=1, stock=1, tags=tags)
+
+    def names(self, response):
+        return sorted(product['name'] for product in response.data['results'])
+
+    def test_any_and_all_tags(self):
+        response = self.client.get('/products/all/', {'tags': 'office, garden'})
+        self.assertEqual(self.names(response), ['Notebook', 'Pencil', 'Spade'])
+        response = self.client.get('/products/all/', {'tags': 'tools,garden', 'tags_mode': 'all'})
+        self.assertEqual(self.names(response), ['Spade'])
+
+    def test_facets_count_filtered_products(self):
+        response = self.client.get('/products/all/', {'tags': 'office,tools', 'facets': 'true'})
+        self.assertEqual(response.data['facets']['tags'], [
+            {'tag': 'office', 'count': 2}, {'tag': 'tools', 'count': 2},
+            {'tag': 'garden', 'count': 1}, {'tag': 'paper', 'count': 1},
+        ])
+        response = self.client.get('/products/all/', {'facets': 'true', 'facet_limit': 1})
+        self.assertEqual(response.data['facets']['tags'], [{'tag': 'office', 'count': 2}])
+
+    def test_facet_limit_bounds(self):
+        self.assertEqual(get_facet_limit({}), FACET_LIMIT)
+        self.assertEqual(get_facet_limit({'facet_limit': 'many'}), FACET_LIMIT)
+        self.assertEqual(get_facet_limit({'facet_limit': '0'}), 1)
+        self.assertEqual(get_facet_limit({'facet_limit': '1000'}), MAX_FACET_LIMIT)
+
+
+
+class ListingCacheTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('cache_reader')
+        cls.product = Product.objects.create(seller=cls.user, name='Notebook', description='-', price=1, stock=1)
+
+    def test_repeated_listing_is_served_from_cache(self):
+        self.client.get('/products/all/', {'tags': 'b,a', 'search': 'Notebook'})
+        with self.assertNumQueries(0):
+            response = self.client.get('/products/all/', {'search': 'notebook', 'tags': 'a,b'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_listing_cache_stats()['hits'], 1)
+        self.assertEqual(get_listing_cache_stats()['misses'], 1)
+
+    def test_update_invalidates_listing(self):
+        self.client.get('/products/all/')
+        response = self.client.put(f'/products/product/{self.product.pk}', {'price': '2.50'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/products/all/')
+        self.assertEqual(response.data['results'][0]['price'], '2.50')
+        self.assertEqual(get_listing_cache_stats()['misses'], 2)
+
+    def test_new_product_invalidates_listing(self):
+        self.client.get('/products/all/')
+        # posting as another user, reads and posts of one user share a throttle history
+        seller = APIClient()
+        seller.force_authenticate(create_user('cache_seller'))
+        response = seller.post('/products/post/', {'name': 'Pencil', 'description': '-', 'price': '1.00', 'stock': 1}, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        response = self.client.get('/products/all/')
+        self.assertEqual([product['name'] for product in response.data['results']], ['Pencil', 'Notebook'])
+
+    def test_stats_are_for_admins(self):
+        self.assertEqual(self.client.get('/products/cache/stats/').status_code, 403)
+        self.client.force_authenticate(CustomUser.objects.create(username='cache_admin', email='admin@example.com', is_staff=True))
+        response = self.client.get('/products/cache/stats/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['ttl'], settings.PRODUCT_LISTING_CACHE_TTL)
+
+
+class ProductETagTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('etag_reader')
+        cls.product = Product.objects.create(seller=cls.user, name='Notebook', description='-', price=1, stock=1)
+
+    def setUp(self):
+        super().setUp()
+        self.url = f'/products/product/{self.product.pk}'
+
+    def test_unchanged_product_is_not_sent_again(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Last-Modified', response)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_update_changes_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        self.client.put(self.url, {'stock': 2}, format='json')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['stock'], 2)
+
+
+class ImportProductsTests(CachedAPITestCase):
+    def setUp(self):
+        self.user = create_user('import_seller')
+        super().setUp()
+
+    def upload(self, body, content_type='text/csv'):
+        return self.client.post('/products/import/', data=body, content_type=content_type)
+
+    def test_csv_rows_with_errors(self):
+        response = self.upload(
+            'name,description,price,stock,tags\n'
+            'Notebook,A4 pages,4.99,10,"paper, office"\n'
+            'Pencil,HB,not-a-price,5,\n'
+            'Eraser,Soft,0.99,3,\n'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (2, 1))
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+        self.assertIn('price', response.data['errors'][0]['errors'])
+        self.assertEqual(Product.objects.get(name='Notebook').tags, ['paper', 'office'])
+
+    def test_ndjson_rows_with_errors(self):
+        response = self.upload(
+            '{"name": "Notebook", "description": "-", "price": "4.99", "stock": 10}\n'
+            '\n'
+            '{"name": "Pencil", \n',
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['errors'][0]['row'], 3)
+
+    def test_all_rows_rejected(self):
+        response = self.upload('name,price\nNotebook,free\n')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['failed'], 1)
+
+    def test_invalid_encoding(self):
+        response = self.upload('name,description,price,stock\nCafé,-,1,1\n'.encode('latin-1'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['errors'], [{'row': 2, 'errors': {'non_field_errors': ['File is not valid UTF-8.']}}])
+
+        # rows before the undecodable line are still imported
+        response = self.upload(b'name,description,price,stock\nTea,-,1,1\n\xff\xfe,-,1,1\n')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (1, 1))
+
+    def test_empty_upload(self):
+        for body in ('', 'name,description,price,stock\n'):
+            with self.subTest(body=body):
+                response = self.upload(body)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data['created'], 0)
+        self.assertEqual(self.upload('', content_type='application/json').status_code, 415)
+
+
+class BulkUpdateTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('bulk_seller')
+        cls.products = [
+            Product.objects.create(seller=cls.user, name=f'Product {number}', description='-', price=10, stock=5)
+            for number in range(3)
+        ]
+        cls.foreign = Product.objects.create(seller=create_user('bulk_other'), name='Foreign', description='-', price=10, stock=5)
+
+    def test_updates_and_skipped_products(self):
+        first, second, third = self.products
+        with self.assertNumQueries(6):
+            response = self.client.put('/products/bulk/', [
+                {'id': first.pk, 'price': '12.50'},
+                {'id': second.pk, 'stock_delta': -2},
+                {'id': third.pk, 'stock_delta': -6},
+                {'id': self.foreign.pk, 'stock': 0},
+                {'id': 0, 'stock': 1},
+            ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['updated'], [first.pk, second.pk])
+        self.assertEqual(response.data['insufficient_stock'], [third.pk])
+        self.assertEqual(response.data['not_owned'], [self.foreign.pk])
+        self.assertEqual(response.data['missing'], [0])
+        self.assertEqual(
+            list(Product.objects.filter(seller=self.user).order_by('pk').values_list('price', 'stock')),
+            [(Decimal('12.50'), 5), (Decimal('10.00'), 3), (Decimal('10.00'), 5)]
+        )
+        self.assertEqual(Product.objects.get(pk=self.foreign.pk).stock, 5)
+
+    def test_invalid_operations(self):
+        pk = self.products[0].pk
+        for operations in ([], [{'id': pk}], [{'id': pk, 'stock': 1, 'stock_delta': 1}], [{'id': pk, 'stock': 1}, {'id': pk, 'price': 1}]):
+            with self.subTest(operations=operations):
+                self.assertEqual(self.client.put('/products/bulk/', operations, format='json').status_code, 400)
+
+
+class ExportProductsTests(CachedAPITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('export_seller')
+        cls.products = [
+            Product.objects.create(seller=cls.user, name=name, description='Soft, "smooth"', price=price, stock=3, tags=tags)
+            for name, price, tags in [('Notebook', '4.50', ['paper', 'office']), ('Pencil', '0.99', [])]
+        ]
+        Product.objects.create(seller=create_user('export_other'), name='Foreign', description='-', price=1, stock=1)
+
+    def test_ndjson_stream(self):
+        response = self.client.get('/products/my/export/')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['name'], row['price'], row['tags']) for row in rows], [
+            ('Notebook', '4.50', ['paper', 'office']), ('Pencil', '0.99', []),
+        ])
+
+    def test_csv_can_be_imported_back(self):
+        response = self.client.get('/products/my/export/', {'file_format': 'csv', 'max_price': 1})
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="products.csv"')
+        content = b''.join(response.streaming_content)
+        rows = list(csv.DictReader(io.StringIO(content.decode())))
+        self.assertEqual([(row['name'], row['description'], row['price']) for row in rows], [('Pencil', 'Soft, "smooth"', '0.99')])
+
+        report = import_products(io.BytesIO(content), 'text/csv', seller=self.user)
+        self.assertEqual((report.created, report.failed), (1, 0))
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/products/my/export/', {'file_format': 'xml'}).status_code, 400)
+
+
+class StampedProductSerializer(ProductSerializer):
+    # product representation with a related key and a datetime, to cover every converter of read plans
+    class Meta:
+        model = Product
+        fields = ['id', 'seller', 'name', 'description', 'price', 'stock', 'tags', 'created_at']
+
+
+class ReadPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        seller = create_user('plan_output_seller')
+        for price, tags in [('0.00', []), ('1.50', ['paper']), ('99999999.99', ['office', 'paper'])]:
+            Product.objects.create(seller=seller, name=f'Product {price}', description='-', price=Decimal(price), stock=0, tags=tags)
+
+    def assertSameOutput(self, serializer_class):
+        plan = ReadPlan(serializer_class)
+        products = list(Product.objects.order_by('pk'))
+        expected = [dict(item) for item in serializer_class(products, many=True).data]
+
+        self.assertEqual(plan.serialize(products), expected)
+        self.assertEqual(plan.serialize(list(Product.objects.order_by('pk').values(*plan.fields))), expected)
+
+    def test_product_serializer_output(self):
+        self.assertEqual(PRODUCT_READ_PLAN.fields, tuple(ProductSerializer().fields))
+        self.assertSameOutput(ProductSerializer)
+
+    @override_settings(TIME_ZONE='Europe/Berlin')
+    def test_related_keys_and_local_datetimes(self):
+        self.assertSameOutput(StampedProductSerializer)
+        self.assertEqual(ReadPlan(StampedProductSerializer).serialize([]), [])
+
+
+class PriceRollupTests(CachedAPITestCase):
+    def setUp(self):
+        self.user = create_user('rollup_seller')
+        super().setUp()
+
+    def create_product(self, price, stock=1, tags=(), seller=None):
+        product = Product.objects.create(
+            seller=seller or self.user, name='Product', description='-', price=Decimal(price), stock=stock, tags=list(tags)
+        )
+        update_rollups(added=[snapshot(product)])
+        return product
+
+    def rollup_rows(self):
+        return list(PriceRollup.objects.order_by('seller_id', 'tag', 'price').values_list(
+            'seller_id', 'tag', 'price', 'product_count', 'stock_total'
+        ))
+
+    def test_histogram(self):
+        for price, stock, tags in [('1.00', 2, ['paper']), ('1.00', 3, []), ('4.00', 1, ['paper']), ('10.00', 4, ['office'])]:
+            self.create_product(price, stock, tags)
+
+        response = self.client.get('/products/stats/', {'buckets': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'products': 4, 'stock_total': 10, 'min_price': '1.00', 'max_price': '10.00', 'avg_price': '4.00',
+            'buckets': [
+                {'min_price': '1.00', 'max_price': '4.00', 'count': 2},
+                {'min_price': '4.00', 'max_price': '7.00', 'count': 1},
+                {'min_price': '7.00', 'max_price': '10.00', 'count': 1},
+            ],
+        })
+
+        stats = catalog_stats(seller_id=self.user.pk, tag='paper', buckets=3)
+        self.assertEqual((stats['products'], stats['stock_total']), (2, 3))
+        self.assertEqual([bucket['count'] for bucket in stats['buckets']], [1, 0, 1])
+        self.assertEqual(catalog_stats(tag='garden')['products'], 0)
+        self.assertEqual(self.client.get('/products/stats/', {'buckets': 'many'}).status_code, 400)
+
+    def test_incremental_updates_match_rebuild(self):
+        other = create_user('rollup_other_seller')
+        products = [
+            self.create_product('1.50', 5, ['paper', 'office']),
+            self.create_product('2.00', 3, ['paper']),
+            self.create_product('2.00', 7, seller=other),
+        ]
+        apply_product_updates([{'id': products[0].pk, 'price': Decimal('2.00')}, {'id': products[1].pk, 'stock_delta': -2}], seller=self.user)
+        self.client.put(f'/products/product/{products[1].pk}', {'tags': ['garden']}, format='json')
+        self.client.delete(f'/products/product/{products[0].pk}')
+
+        incremental = self.rollup_rows()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollup_rows())
+
+    def test_prices_without_products_are_deleted(self):
+        product = self.create_product('3.00', 2, ['paper'])
+        self.assertEqual(len(self.rollup_rows()), 4)
+
+        with self.assertNumQueries(2):
+            update_rollups(removed=[snapshot(product)])
+        self.assertEqual(self.rollup_rows(), [])
+
+
+class ConcurrentRollupTests(TransactionTestCase):
+    # writers touching the same prices in opposite orders must not deadlock each other
+    def test_opposite_orders(self):
+        seller = create_user('concurrent_rollup_seller')
+        snapshots = [(seller.pk, Decimal(number), 1, ('paper',)) for number in range(1, 501)]
+        update_rollups(added=snapshots)
+        errors = []
+
+        def write(ordered):
+            try:
+                for _ in range(10):
+                    with transaction.atomic():
+                        update_rollups(added=ordered)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=write, args=(order,)) for order in (snapshots, snapshots[::-1]) * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(catalog_stats()['products'], 500 * 41)
@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .models import Product
+from .rollups import update_rollups
+from cart.summary import carts_with_products, refresh_cart_summaries
+
+
+MAX_OPERATIONS = 1000
+
+
+def apply_product_updates(operations, seller):
+    # applying price and stock changes to seller's own products with a single UPDATE statement
+    report = {'updated': [], 'missing': [], 'not_owned': [], 'insufficient_stock': []}
+    ids = [operation['id'] for operation in operations]
+
+    with transaction.atomic():
+        # locking affected rows in id order, so concurrent batches cannot deadlock
+        rows = Product.objects.select_for_update().filter(pk__in=ids).order_by('pk').values_list('pk', 'seller_id', 'price', 'stock', 'tags')
+        found = {pk: (seller_id, price, stock, tuple(tags)) for pk, seller_id, price, stock, tags in rows}
+
+        now = timezone.now()
+        products = []
+        before, after = [], []
+        for operation in operations:
+            pk = operation['id']
+            if pk not in found:
+                report['missing'].append(pk)
+                continue
+            seller_id, price, stock, tags = found[pk]
+            if seller_id != seller.pk:
+                report['not_owned'].append(pk)
+                continue
+            if stock + operation.get('stock_delta', 0) < 0:
+                report['insufficient_stock'].append(pk)
+                continue
+
+            # untouched fields are assigned to themselves, deltas are applied by the database
+            if 'stock' in operation:
+                new_stock = operation['stock']
+            elif 'stock_delta' in operation:
+                new_stock = F('stock') + operation['stock_delta']
+            else:
+                new_stock = F('stock')
+            products.append(Product(pk=pk, price=operation.get('price', F('price')), stock=new_stock, updated_at=now))
+            report['updated'].append(pk)
+
+            # rows are locked, so the resulting values are known exactly
+            before.append((seller_id, price, stock, tags))
+            after.append((
+                seller_id,
+                operation.get('price', price),
+                operation.get('stock', stock + operation.get('stock_delta', 0)),
+                tags
+            ))
+
+        if products:
+            fields = ['updated_at']
+            if any('price' in operation for operation in operations):
+                fields.append('price')
+            if any('stock' in operation or 'stock_delta' in operation for operation in operations):
+                fields.append('stock')
+            Product.objects.bulk_update(products, fields)
+            update_rollups(added=after, removed=before)
+            if 'price' in fields:
+                refresh_cart_summaries(carts_with_products(report['updated']))
+
+    return report
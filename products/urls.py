@@ -5,6 +5,12 @@ from . import views
 urlpatterns = [
     path(route='all/', view=views.all_products, name='All products'),
     path(route='my/', view=views.my_products, name='List products of user'),
+    path(route='my/export/', view=views.export_my_products, name='Export products of user'),
+    path(route='autocomplete/', view=views.autocomplete_products, name='Autocomplete product names'),
     path(route='post/', view=views.post_new_product, name='Post a new product'),
-    path(route='product/<int:pk>', view=views.product_by_id, name='Product by id')
+    path(route='import/', view=views.import_new_products, name='Import products in bulk'),
+    path(route='bulk/', view=views.bulk_update_products, name='Update price and stock in bulk'),
+    path(route='product/<int:pk>', view=views.product_by_id, name='Product by id'),
+    path(route='stats/', view=views.catalog_statistics, name='Catalog statistics'),
+    path(route='cache/stats/', view=views.listing_cache_stats, name='Product listing cache stats')
 ]
\ No newline at end of file
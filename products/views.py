@@ -3,11 +3,23 @@ from rest_framework.response import Response
 from rest_framework import status
 from users.models import CustomUser
 from .models import Product
-from .serializers import ProductSerializer
-from rest_framework.permissions import IsAuthenticated
+from .serializers import ProductSerializer, ProductUpdateOperationSerializer, PRODUCT_READ_PLAN
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.throttling import UserRateThrottle
-from django.db.models import Q
+from .search import search_products
+from .facets import tag_facets, get_facet_limit
+from .imports import import_products, is_supported
+from .updates import apply_product_updates, MAX_OPERATIONS
+from .exports import export_rows, ENCODERS, EXPORT_FORMATS
+from .rollups import snapshot, update_rollups, catalog_stats, MAX_BUCKETS
+from .autocomplete import autocomplete_names, get_autocomplete_limit, record_name_changes
+from cart.summary import carts_with_products, refresh_cart_summaries
+from django.http import StreamingHttpResponse
+from django.db import transaction
+from .cache import listing_cache_key, get_cached_listing, cache_listing, invalidate_product_listings, get_listing_cache_stats
+from ecommerce_api.pagination import KeysetPagination
+from ecommerce_api.conditional import serializer_fingerprint, make_etag, conditional_response, set_conditional_headers
 
 
 # rate limiters (throttle)
@@ -17,36 +29,80 @@ class GetProductRateThrottle(UserRateThrottle):
 class PostProductRateThrottle(UserRateThrottle):
     rate = '1/min'
 
+class ImportProductRateThrottle(UserRateThrottle):
+    scope = 'product_import'
+    rate = '10/hour'
 
-@permission_classes([IsAuthenticated])
-@api_view(['GET'])
-@throttle_classes([GetProductRateThrottle])
-def all_products(request):
-    # listing all products
-    queryset = Product.objects.all().order_by('-created_at')
+class ExportProductRateThrottle(UserRateThrottle):
+    scope = 'product_export'
+    rate = '10/hour'
 
-    # filtering products
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    search = request.GET.get('search')
+class AutocompleteRateThrottle(UserRateThrottle):
+    scope = 'autocomplete'
+    rate = '120/min'
+
+
+# helper function to apply query parameters' filters to products
+def filter_products(queryset, params, rank=True):
+    min_price = params.get('min_price')
+    max_price = params.get('max_price')
+    search = params.get('search')
+    tags = [tag.strip() for tag in params.get('tags', '').split(',') if tag.strip()]
 
     if min_price:
         queryset = queryset.filter(price__gte=min_price)
     if max_price:
         queryset = queryset.filter(price__lte=max_price)
     if search:
-        queryset = queryset.filter(
-            Q(name__icontains=search) |
-            Q(description__icontains=search)
-        )
+        queryset = search_products(queryset, search, rank=rank)
+    if tags:
+        # 'any' matches products with at least one of the tags, 'all' requires every tag
+        if params.get('tags_mode') == 'all':
+            queryset = queryset.filter(tags__contains=tags)
+        else:
+            queryset = queryset.filter(tags__overlap=tags)
+    return queryset
 
-    # paginating and serializing queryset
-    paginator = PageNumberPagination()
-    paginated_qs = paginator.paginate_queryset(queryset, request)
-    serializer = ProductSerializer(paginated_qs, many=True)
 
-    # returing paginated result
-    return paginator.get_paginated_response(serializer.data)
+# helper function to attach tag counts of the filtered products to a response
+def add_facets(response, queryset, params):
+    if params.get('facets', '').lower() in ('1', 'true', 'yes'):
+        response.data['facets'] = {'tags': tag_facets(queryset, limit=get_facet_limit(params))}
+    return response
+
+
+# helper function to choose between page number and cursor pagination
+def get_product_paginator(request):
+    if request.GET.get('pagination') == 'cursor' or 'cursor' in request.GET:
+        return KeysetPagination(ordering=('-created_at', '-id'))
+    return PageNumberPagination()
+
+
+@permission_classes([IsAuthenticated])
+@api_view(['GET'])
+@throttle_classes([GetProductRateThrottle])
+def all_products(request):
+    # returning cached listing if the catalog has not changed since it was stored
+    cache_key = listing_cache_key(request)
+    cached = get_cached_listing(cache_key)
+    if cached is not None:
+        return Response(data=cached, status=status.HTTP_200_OK)
+
+    # listing all products
+    queryset = Product.objects.all().order_by('-created_at')
+
+    # filtering products, cursor pages keep their own ordering instead of search relevance
+    paginator = get_product_paginator(request)
+    queryset = filter_products(queryset, request.GET, rank=not isinstance(paginator, KeysetPagination))
+
+    # paginating plain rows and serializing them with the compiled read plan
+    paginated_qs = paginator.paginate_queryset(queryset.values(*PRODUCT_READ_PLAN.fields, 'created_at'), request)
+    data = PRODUCT_READ_PLAN.serialize(paginated_qs)
+
+    # returing paginated result, with facets if requested, and caching it
+    response = add_facets(paginator.get_paginated_response(data), queryset, request.GET)
+    cache_listing(cache_key, response.data)
+    return response
 
 
 
@@ -65,31 +121,33 @@ def my_products(request):
     queryset = Product.objects.filter(seller=request.user.pk).order_by('-created_at')
 
     # filtering products
-    min_price = request.GET.get('min_price')
-    max_price = request.GET.get('max_price')
-    search = request.GET.get('search')
+    queryset = filter_products(queryset, request.GET)
 
-    if min_price:
-        queryset = queryset.filter(price__gte=min_price)
-    if max_price:
-        queryset = queryset.filter(price__lte=max_price)
-    if search:
-        queryset = queryset.filter(
-            Q(name__icontains=search) |
-            Q(description__icontains=search)
-        )
-    
+    # paginating queryset, an empty first page means there is nothing to list
+    paginator = PageNumberPagination()
+    paginated_qs = paginator.paginate_queryset(queryset.values(*PRODUCT_READ_PLAN.fields), request)
+    if not paginated_qs:
+        return Response(data={'msg': 'You have not posted any products.'}, status=status.HTTP_200_OK)
 
-    if queryset:
-        # paginating and serializing queryset
-        paginator = PageNumberPagination()
-        paginated_qs = paginator.paginate_queryset(queryset, request)
-        serializer = ProductSerializer(paginated_qs, many=True)
+    # serializing and returing paginated result, with facets if requested
+    response = paginator.get_paginated_response(PRODUCT_READ_PLAN.serialize(paginated_qs))
+    return add_facets(response, queryset, request.GET)
 
-        # returing paginated result
-        return paginator.get_paginated_response(serializer.data)
-    else:
-        return Response(data={'msg': 'You have not posted any products.'}, status=status.HTTP_200_OK)
+
+@permission_classes([IsAuthenticated])
+@api_view(['GET'])
+@throttle_classes([ExportProductRateThrottle])
+def export_my_products(request):
+    # checking requested file format
+    file_format = request.GET.get('file_format', 'ndjson')
+    if file_format not in ENCODERS:
+        return Response(data={'msg': f"Supported file formats: {', '.join(ENCODERS)}."}, status=status.HTTP_400_BAD_REQUEST)
+
+    # streaming all products user posted, optionally filtered, with constant memory
+    queryset = filter_products(Product.objects.filter(seller=request.user.pk), request.GET, rank=False)
+    response = StreamingHttpResponse(ENCODERS[file_format](export_rows(queryset)), content_type=EXPORT_FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+    return response
     
 
 @permission_classes([IsAuthenticated])
@@ -108,12 +166,58 @@ def post_new_product(request):
 
     # checking if data is valid
     if new_product.is_valid():
-        new_product.save(seller=request.user)
+        with transaction.atomic():
+            product = new_product.save(seller=request.user)
+            update_rollups(added=[snapshot(product)])
+        invalidate_product_listings()
+        record_name_changes([product.name])
         return Response(data={**new_product.data, 'msg': 'Product was posted successfully.'}, status=status.HTTP_201_CREATED)
     else:
         return Response(new_product.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+@permission_classes([IsAuthenticated])
+@api_view(['POST'])
+@throttle_classes([ImportProductRateThrottle])
+def import_new_products(request):
+    # checking format of the upload, it is parsed as a stream and never through request.data
+    content_type = request.content_type.split(';')[0].strip().lower()
+    if not is_supported(content_type):
+        return Response(data={'msg': 'Upload products as text/csv or application/x-ndjson.'}, status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE)
+
+    # importing products row by row in batches
+    report = import_products(request.stream or [], content_type, seller=request.user)
+    if report.created:
+        invalidate_product_listings()
+
+    # returning report with errors of rejected rows, an upload without any rows is rejected as well
+    if not report.created and not report.failed:
+        return Response(data={**report.as_dict(), 'msg': 'The upload contains no products.'}, status=status.HTTP_400_BAD_REQUEST)
+    if report.created:
+        return Response(data={**report.as_dict(), 'msg': 'Products were imported.'}, status=status.HTTP_201_CREATED)
+    else:
+        return Response(data={**report.as_dict(), 'msg': 'No products were imported.'}, status=status.HTTP_400_BAD_REQUEST)
+
+
+@permission_classes([IsAuthenticated])
+@api_view(['PUT'])
+def bulk_update_products(request):
+    # validating list of operations
+    operations = ProductUpdateOperationSerializer(data=request.data, many=True, max_length=MAX_OPERATIONS, allow_empty=False)
+    if not operations.is_valid():
+        return Response(data=operations.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    ids = [operation['id'] for operation in operations.validated_data]
+    if len(ids) != len(set(ids)):
+        return Response(data={'msg': 'Each product can only be updated once per request.'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # updating user's products and reporting the ones that were skipped
+    report = apply_product_updates(operations.validated_data, seller=request.user)
+    if report['updated']:
+        invalidate_product_listings()
+    return Response(data={**report, 'msg': f"{len(report['updated'])} products were updated."}, status=status.HTTP_200_OK)
+
+
 @permission_classes([IsAuthenticated])
 @api_view(['GET', 'PUT', 'DELETE'])
 def product_by_id(request, pk):
@@ -124,10 +228,16 @@ def product_by_id(request, pk):
     except CustomUser.DoesNotExist and Product.DoesNotExist:
         return Response(data={'msg': 'Invalid request'}, status=status.HTTP_404_NOT_FOUND)
     
-    # getting product information by id
+    # getting product information by id, unless client's copy is still up to date
     if request.method == 'GET':
+        etag = make_etag(productObject.pk, productObject.updated_at.isoformat(), serializer_fingerprint(ProductSerializer))
+        not_modified = conditional_response(request, etag, productObject.updated_at)
+        if not_modified is not None:
+            return not_modified
+
         product = ProductSerializer(productObject)
-        return Response(data=product.data, status=status.HTTP_200_OK)
+        response = Response(data=product.data, status=status.HTTP_200_OK)
+        return set_conditional_headers(response, etag, productObject.updated_at)
     # updating product by id
     elif request.method == 'PUT':
         # getting data from request
@@ -135,11 +245,61 @@ def product_by_id(request, pk):
 
         # checking if data is valid
         if updated_product.is_valid():
-            updated_product.save()
+            before = snapshot(productObject)
+            old_name, old_price = productObject.name, productObject.price
+            with transaction.atomic():
+                product = updated_product.save()
+                update_rollups(added=[snapshot(product)], removed=[before])
+                # totals of carts holding the product follow its new price
+                if product.price != old_price:
+                    refresh_cart_summaries(carts_with_products([product.pk]))
+            invalidate_product_listings()
+            if product.name != old_name:
+                record_name_changes([old_name, product.name])
             return Response(data={**updated_product.data, 'msg': 'Product information was updated successfully'}, status=status.HTTP_200_OK)
         else:
             return Response(data=updated_product.errors, status=status.HTTP_400_BAD_REQUEST)
     # deleting product by id
     elif request.method == 'DELETE':
-        productObject.delete()
+        with transaction.atomic():
+            # carts holding the product are locked before its cart items are deleted with it
+            cart_ids = carts_with_products([productObject.pk])
+            update_rollups(removed=[snapshot(productObject)])
+            productObject.delete()
+            refresh_cart_summaries(cart_ids)
+        invalidate_product_listings()
+        record_name_changes([productObject.name])
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@permission_classes([IsAuthenticated])
+@api_view(['GET'])
+@throttle_classes([AutocompleteRateThrottle])
+def autocomplete_products(request):
+    # suggesting product names that start with the typed prefix
+    prefix = request.GET.get('q', '').strip()
+    if not prefix:
+        return Response(data={'results': []}, status=status.HTTP_200_OK)
+    return Response(data={'results': autocomplete_names(prefix, get_autocomplete_limit(request.GET))}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def listing_cache_stats(request):
+    # hit and miss counters of the product listing cache, for tuning its ttl
+    return Response(data=get_listing_cache_stats(), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def catalog_statistics(request):
+    # reading scope and number of price buckets
+    try:
+        seller_id = int(request.GET.get('seller', 0))
+        buckets = min(max(int(request.GET.get('buckets', 10)), 1), MAX_BUCKETS)
+    except ValueError:
+        return Response(data={'msg': "'seller' and 'buckets' must be integers."}, status=status.HTTP_400_BAD_REQUEST)
+    tag = request.GET.get('tag', '').strip()
+
+    # returning price histogram and totals from the rollup table
+    return Response(data=catalog_stats(seller_id=seller_id, tag=tag, buckets=buckets), status=status.HTTP_200_OK)